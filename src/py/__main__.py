@@ -0,0 +1,39 @@
+import importlib
+import sys
+
+# name in usage and error messages, whatever directory the package is run from
+PROG = 'sustainable-space'
+
+# command -> (module, help); modules are only imported once their command is chosen
+COMMANDS = {
+    'generate': ('generate_models', 'Create GLTF or STL models of planetary Roche potentials'),
+    'plot': ('roche_lagrangian', 'Plot the Roche potentials of the solar system'),
+    'table': ('system_table', 'Tabulate Lagrange points of every body'),
+    'tiles': ('map_tiles', 'Render the solar system map as slippy-map tiles'),
+    'bench': ('benchmark', 'Benchmark the pipeline stages against stored baselines'),
+    'sweep': ('sweep', 'Sweep Roche lobes and Lagrange points over mass ratios and distances'),
+    'orbits': ('ephemeris', 'Write position tracks of bodies and Lagrange points for animation'),
+    'serve': ('model_service', 'Serve GLTF models of posted bodies over HTTP'),
+}
+
+
+def usage(prog: str) -> str:
+    lines = ['usage: %s <command> [options]' % prog, '', 'commands:']
+    lines += ['  %-10s %s' % (name, text) for name, (_, text) in COMMANDS.items()]
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    prog = PROG
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage(prog))
+        return
+    if argv[0] not in COMMANDS:
+        sys.exit('%s: unknown command %r\n%s' % (prog, argv[0], usage(prog)))
+    module = importlib.import_module(COMMANDS[argv[0]][0])
+    module.main(argv[1:], prog='%s %s' % (prog, argv[0]))
+
+
+if __name__ == "__main__":
+    main()
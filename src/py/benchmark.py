@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from instrument import peak_rss
+from solar_constants import Planets
+
+BASELINE = 'benchmark.json'
+TOLERANCE = .25
+# timings below this many seconds are too noisy to flag as regressions
+MIN_WALL = .05
+
+
+def _sampling(points: int, bodies: list, directory: str):
+    from roche_lagrangian import RocheLagrangian
+    systems = [RocheLagrangian(body.orbits.mass, body.mass, body.semimajor) for body in bodies]
+
+    def run():
+        grids = [rl.cartesian_sampling(points, radius=1.725, limit=.5, mesh=True) for rl in systems]
+        return sum(axis.nbytes for grid in grids for axis in grid)
+    return run
+
+
+def _export(writer: str, points: int, bodies: list, directory: str):
+    import generate_models
+    grids = [generate_models._planet_to_mesh(body, points=points) for body in bodies]
+    func = getattr(generate_models, writer)
+
+    def run():
+        return sum(os.path.getsize(func(body, directory, grid=grid)) for body, grid in zip(bodies, grids))
+    return run
+
+
+def _gltf(points: int, bodies: list, directory: str):
+    return _export('to_gltf', points, bodies, directory)
+
+
+def _stl(points: int, bodies: list, directory: str):
+    return _export('to_stl', points, bodies, directory)
+
+
+def _plot(points: int, bodies: list, directory: str):
+    import matplotlib
+    matplotlib.use('Agg')
+    from roche_lagrangian import plot_solar_system
+
+    def run():
+        # a low dpi keeps the 100 inch figure within memory; sampling and drawing are unchanged
+        plot_solar_system(directory, force=True, points=points, bodies=bodies, dpi=10)
+        return os.path.getsize(os.path.join(directory, 'solar_system.svg'))
+    return run
+
+
+# stage -> setup(points, bodies, directory) returning the timed callable, which returns output bytes
+STAGES = {
+    'sampling': _sampling,
+    'gltf': _gltf,
+    'stl': _stl,
+    'plot': _plot,
+}
+
+
+def _measure(stage: str, points: int, count: int, repeat: int) -> dict:
+    """Best wall time, peak RSS and output size of one stage, run in a fresh process"""
+    with tempfile.TemporaryDirectory() as directory:
+        run = STAGES[stage](points, Planets[:count], directory)
+        times, size = [], 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # the stages report progress
+                size = run()
+            times.append(time.perf_counter() - start)
+    return dict(wall=min(times), rss=peak_rss(), bytes=size)
+
+
+def run_benchmarks(stages: list[str], points: list[int], bodies: list[int], repeat: int = 3) -> dict:
+    """Results keyed by stage/points/bodies, each measured in its own spawned process"""
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for stage in stages:
+        for n_points in points:
+            for count in bodies:
+                key = '%s/%d/%d' % (stage, n_points, count)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    results[key] = pool.submit(_measure, stage, n_points, count, repeat).result()
+                print('%-20s %8.3f s %8.1f MiB %10d bytes'
+                      % (key, results[key]['wall'], results[key]['rss'] / 2**20, results[key]['bytes']))
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """Measurements exceeding their baseline by more than tolerance (a fraction)"""
+    failures = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric, value in result.items():
+            previous = baseline[key][metric]
+            if metric == 'wall' and value < MIN_WALL:
+                continue
+            if value > previous * (1 + tolerance):
+                failures.append('%s %s: %g > %g' % (key, metric, value, previous))
+    return failures
+
+
+def main(argv: list[str] = None, prog: str = None):
+    parser = argparse.ArgumentParser(
+        prog=prog or os.path.basename(__file__),
+        description='Benchmark sampling, meshing and export stages against stored baselines')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help='Stages to measure')
+    parser.add_argument('--points', nargs='+', type=int, default=[50, 100, 200], help='Sampling densities to sweep')
+    parser.add_argument('--bodies', nargs='+', type=int, default=[1, 3], help='Body counts to sweep')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the fastest is kept')
+    parser.add_argument('-b', '--baseline', type=str, default=BASELINE, help='Baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Allowed fractional slowdown or growth')
+    parser.add_argument('--save', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.stages, args.points, args.bodies, args.repeat)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Saved baseline to %s' % args.baseline)
+        return
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at %s, run with --save to create one' % args.baseline)
+        return
+    with open(args.baseline) as f:
+        failures = regressions(results, json.load(f), args.tolerance)
+    for failure in failures:
+        print('REGRESSION ' + failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+
+from solar_constants import Celestial, with_primaries
+
+# bodies' gravity is summed within this many Hill radii of them
+REACH = 8.
+
+
+def placements(bodies: list[Celestial]) -> dict[str, tuple[float, float]]:
+    """(x, y) km of bodies and their primaries, each on +x from its primary and the root at the origin"""
+    placed = {}
+    for body in with_primaries(bodies):
+        x = placed[body.orbits.name][0] + body.semimajor if body.orbits is not None else 0.
+        placed[body.name] = (x, 0.)
+    return placed
+
+
+class Subsystem:
+    """A body and its primary rotating about their barycenter, in units of their separation and mass"""
+
+    def __init__(self, body: Celestial, primary_position: tuple[float, float]):
+        self.body = body
+        self.scale = body.semimajor  # km
+        self.mass = body.orbits.mass + body.mass  # kg
+        self.center = primary_position[0] + body.mass / self.mass * self.scale, primary_position[1]
+
+    def centrifugal(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        return -0.5 * (np.square((x - self.center[0]) / self.scale) + np.square((y - self.center[1]) / self.scale))
+
+    def gravity(self, x: np.ndarray, y: np.ndarray, position: tuple[float, float], mass: float) -> np.ndarray:
+        """Potential of a point mass at position, in this subsystem's units"""
+        return -(mass / self.mass) / (np.hypot(x - position[0], y - position[1]) / self.scale)
+
+    def tidal(self, x: np.ndarray, y: np.ndarray, position: tuple[float, float], mass: float) -> np.ndarray:
+        """gravity less its value and gradient at the barycenter, which the whole subsystem falls with"""
+        s_x, s_y = (position[0] - self.center[0]) / self.scale, (position[1] - self.center[1]) / self.scale
+        distance = math.hypot(s_x, s_y)
+        mu = mass / self.mass
+        u_x, u_y = (x - self.center[0]) / self.scale, (y - self.center[1]) / self.scale
+        return self.gravity(x, y, position, mass) + mu / distance + mu * (s_x * u_x + s_y * u_y) / distance ** 3
+
+
+class BinGrid:
+    """Square bins over the plane listing the bodies whose reach overlaps each, so queries over
+    a region skip every body too far away to matter; bodies of infinite reach are always listed"""
+
+    def __init__(self, centers: np.ndarray, radii: np.ndarray, size: float):
+        self.size = size
+        self.everywhere = [index for index, radius in enumerate(radii) if not np.isfinite(radius)]
+        self.bins = {}
+        for index, ((x, y), radius) in enumerate(zip(centers, radii)):
+            if not np.isfinite(radius):
+                continue
+            for column in range(math.floor((x - radius) / size), math.floor((x + radius) / size) + 1):
+                for row in range(math.floor((y - radius) / size), math.floor((y + radius) / size) + 1):
+                    self.bins.setdefault((column, row), []).append(index)
+
+    def query(self, x_min: float, y_min: float, x_max: float, y_max: float) -> list[int]:
+        """Sorted indices of bodies that may reach the rectangle"""
+        found = set(self.everywhere)
+        columns = range(math.floor(x_min / self.size), math.floor(x_max / self.size) + 1)
+        rows = range(math.floor(y_min / self.size), math.floor(y_max / self.size) + 1)
+        if len(columns) * len(rows) > len(self.bins):
+            cells = [cell for cell in self.bins if cell[0] in columns and cell[1] in rows]
+        else:
+            cells = [(column, row) for column in columns for row in rows]
+        for cell in cells:
+            found.update(self.bins.get(cell, ()))
+        return sorted(found)
+
+
+class CompositePotential:
+    """Roche potential of a hierarchy of bodies in one frame, every body placed on +x
+
+    Evaluated in the rotating frame and units of one body's subsystem: the pair's gravity and
+    centrifugal term, which alone are exactly roche_potential about its barycenter, plus the
+    tidal potential of every other body within reach. So a satellite's well shows in its
+    planet's field, and the planet's primary stretches the satellite's.
+    """
+
+    def __init__(self, bodies: list[Celestial], reach: float = REACH, bin_size: float = None):
+        self.bodies = with_primaries(bodies)
+        placed = placements(self.bodies)
+        self.positions = np.array([placed[body.name] for body in self.bodies])
+        self.masses = np.array([body.mass for body in self.bodies])
+        self.subsystems = {body.name: Subsystem(body, placed[body.orbits.name])
+                           for body in self.bodies if body.orbits is not None}
+        self.radii = np.array([reach * body.semimajor * np.cbrt(body.mass / (3. * body.orbits.mass))
+                               if body.orbits is not None else np.inf for body in self.bodies])
+        finite = self.radii[np.isfinite(self.radii)]
+        self.bins = BinGrid(self.positions, self.radii, bin_size or (float(np.median(finite)) if len(finite) else 1.))
+
+    def key(self) -> tuple:
+        """Everything evaluate depends on, for cache keys"""
+        return tuple(self.positions.ravel().tolist()) + tuple(self.masses.tolist()) + tuple(self.radii.tolist())
+
+    def evaluate(self, x: np.ndarray, y: np.ndarray, frame: str) -> np.ndarray:
+        """Potential at km (x, y) in the frame of the subsystem of the body named frame"""
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        subsystem = self.subsystems[frame]
+        pair = {self.bodies.index(subsystem.body), self.bodies.index(subsystem.body.orbits)}
+        phi = subsystem.centrifugal(x, y)
+        if x.size == 0:
+            return phi
+        # the pair always counts, however far its reach
+        for body in sorted(pair | set(self.bins.query(x.min(), y.min(), x.max(), y.max()))):
+            position, radius = self.positions[body], self.radii[body]
+            if body in pair:
+                phi += subsystem.gravity(x, y, position, self.masses[body])
+            elif not np.isfinite(radius):
+                phi += subsystem.tidal(x, y, position, self.masses[body])
+            else:
+                within = (np.abs(x - position[0]) <= radius) & (np.abs(y - position[1]) <= radius)
+                phi[within] += subsystem.tidal(x[within], y[within], position, self.masses[body])
+        return phi
@@ -0,0 +1,163 @@
+import numpy as np
+
+# cell edges: 0 top (corners a-b), 1 right (b-c), 2 bottom (d-c), 3 left (a-d),
+# with corners a=(i, j), b=(i, j+1), c=(i+1, j+1), d=(i+1, j)
+_SEGMENTS = {
+    1: [(3, 0)], 2: [(0, 1)], 3: [(3, 1)], 4: [(1, 2)], 6: [(0, 2)], 7: [(3, 2)], 8: [(2, 3)],
+    9: [(0, 2)], 11: [(1, 2)], 12: [(1, 3)], 13: [(0, 1)], 14: [(3, 0)],
+}
+# saddles, keyed by whether the cell centre is above the level
+_SADDLES = {
+    (5, False): [(3, 0), (1, 2)], (5, True): [(0, 1), (2, 3)],
+    (10, False): [(0, 1), (2, 3)], (10, True): [(3, 0), (1, 2)],
+}
+
+
+def marching_squares(x: np.ndarray, y: np.ndarray, z: np.ndarray, level: float) -> list[np.ndarray]:
+    """(n, 2) polylines where z crosses level on a structured grid; closed rings repeat their first point
+
+    x and y may be any structured grid (e.g. the polar meshgrid). Cells touching NaN are skipped,
+    infinities just count as above or below.
+    """
+    rows, cols = z.shape
+    above = z > level
+    valid = ~np.isnan(z)
+    case = (above[:-1, :-1] * 1 + above[:-1, 1:] * 2 + above[1:, 1:] * 4 + above[1:, :-1] * 8)
+    case[~(valid[:-1, :-1] & valid[:-1, 1:] & valid[1:, 1:] & valid[1:, :-1])] = 0
+
+    # only cells the level passes through from here on
+    i, j = np.unravel_index(np.flatnonzero((case != 0) & (case != 15)), case.shape)
+    case = case[i, j]
+    centre = (z[i, j] + z[i, j + 1] + z[i + 1, j + 1] + z[i + 1, j]) / 4. > level
+    horizontal = rows * (cols - 1)  # edge ids: horizontal edges first, then vertical
+    edges = np.stack((i * (cols - 1) + j,                       # top
+                      horizontal + i * cols + j + 1,             # right
+                      (i + 1) * (cols - 1) + j,                  # bottom
+                      horizontal + i * cols + j), axis=-1)       # left
+
+    segments = []
+    for key, pairs in list(_SEGMENTS.items()) + list(_SADDLES.items()):
+        if isinstance(key, tuple):
+            cells = (case == key[0]) & (centre == key[1])
+        else:
+            cells = case == key
+        cell_edges = edges[cells]
+        for first, second in pairs:
+            segments.append(np.stack((cell_edges[:, first], cell_edges[:, second]), axis=-1))
+    segments = np.concatenate(segments)
+
+    # interpolate the crossing on each edge used
+    used, segments = np.unique(segments, return_inverse=True)
+    segments = segments.reshape(-1, 2)
+    is_vertical = used >= horizontal
+    r0 = np.where(is_vertical, (used - horizontal) // cols, used // (cols - 1))
+    c0 = np.where(is_vertical, (used - horizontal) % cols, used % (cols - 1))
+    r1 = r0 + is_vertical
+    c1 = c0 + ~is_vertical
+    z0, z1 = z[r0, c0], z[r1, c1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.nan_to_num(np.clip((level - z0) / (z1 - z0), 0., 1.))
+    positions = np.stack((x[r0, c0] + t * (x[r1, c1] - x[r0, c0]),
+                          y[r0, c0] + t * (y[r1, c1] - y[r0, c0])), axis=-1)
+    return [positions[chain] for chain in _chain(segments)]
+
+
+def _chain(segments: np.ndarray) -> list[list[int]]:
+    """Join segments sharing an edge into ordered chains of edge ids"""
+    touching = {}
+    for index, (first, second) in enumerate(segments.tolist()):
+        touching.setdefault(first, []).append(index)
+        touching.setdefault(second, []).append(index)
+    used = np.zeros(len(segments), dtype=bool)
+    pairs = segments.tolist()
+
+    def _extend(chain: list[int]):
+        while True:
+            following = [index for index in touching[chain[-1]] if not used[index]]
+            if not following:
+                return
+            used[following[0]] = True
+            first, second = pairs[following[0]]
+            chain.append(second if first == chain[-1] else first)
+
+    chains = []
+    for start in range(len(pairs)):
+        if used[start]:
+            continue
+        used[start] = True
+        chain = list(pairs[start])
+        _extend(chain)
+        chain.reverse()
+        _extend(chain)
+        chains.append(chain)
+    return chains
+
+
+def marching_squares_bands(x: np.ndarray, y: np.ndarray, z: np.ndarray, level: float,
+                           rows: int) -> list[np.ndarray]:
+    """marching_squares over bands of rows (sharing their last row with the next), stitched
+
+    Only one band of the grids is read at a time, so memory-mapped grids are never loaded
+    whole. Lines cut by a band edge end on the same crossing in both bands, and are joined there.
+    """
+    rows = max(rows, 1)
+    lines = []
+    for start in range(0, max(len(z) - 1, 1), rows):
+        band = slice(start, min(start + rows + 1, len(z)))
+        lines += marching_squares(np.asarray(x[band]), np.asarray(y[band]), np.asarray(z[band]), level)
+    return _stitch(lines)
+
+
+def _stitch(lines: list[np.ndarray]) -> list[np.ndarray]:
+    """Join polylines whose ends meet exactly"""
+    ends = {}
+    for index, line in enumerate(lines):
+        ends.setdefault(tuple(line[0]), []).append(index)
+        ends.setdefault(tuple(line[-1]), []).append(index)
+    used = np.zeros(len(lines), dtype=bool)
+    joined = []
+    for start in range(len(lines)):
+        if used[start]:
+            continue
+        used[start] = True
+        line = lines[start]
+        for _ in range(2):  # extend the tail, then the head by extending the reversed line
+            while True:
+                tail = tuple(line[-1])
+                following = [index for index in ends[tail] if not used[index]]
+                if not following:
+                    break
+                used[following[0]] = True
+                other = lines[following[0]]
+                line = np.concatenate((line, (other if tuple(other[0]) == tail else other[::-1])[1:]))
+            line = line[::-1]
+        joined.append(line)
+    return joined
+
+
+def simplify(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker simplification of an (n, 2) polyline, keeping points further than tolerance"""
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        span = end - start
+        length = np.hypot(*span)
+        inner = points[first + 1:last] - start
+        if length > 0:
+            distance = np.abs(span[0] * inner[:, 1] - span[1] * inner[:, 0]) / length
+        else:  # closed ring: distance from the shared endpoint
+            distance = np.hypot(inner[:, 0], inner[:, 1])
+        index = int(np.argmax(distance))
+        if distance[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+from roche_lagrangian import lagrange_points
+from solar_constants import Celestial, Planets, Satellites, with_primaries
+from system_table import POINTS
+
+TRACK_MAGIC = b'RLTRACK1'
+# data starts on this boundary, so readers can map the frames directly
+TRACK_ALIGN = 16
+DAY = 86400.
+
+
+def eccentric_anomaly(mean_anomaly: np.ndarray, eccentricity: np.ndarray, tolerance: float = 1e-12,
+                      iterations: int = 32) -> np.ndarray:
+    """Solve Kepler's equation E - e sin E = M by Newton's method, elementwise over broadcast arrays"""
+    mean_anomaly, eccentricity = np.broadcast_arrays(mean_anomaly, eccentricity)
+    anomaly = mean_anomaly + eccentricity * np.sin(mean_anomaly)
+    for _ in range(iterations):
+        step = (anomaly - eccentricity * np.sin(anomaly) - mean_anomaly) / (1. - eccentricity * np.cos(anomaly))
+        anomaly = anomaly - step
+        if np.max(np.abs(step), initial=0.) < tolerance:
+            break
+    return anomaly
+
+
+def orbit_offsets(bodies: list[Celestial], times: np.ndarray) -> np.ndarray:
+    """(bodies, times, 2) positions in km relative to the body each orbits, times in seconds from epoch
+
+    Orbits are coplanar Keplerian ellipses with periapsis on +x, every body at periapsis at
+    epoch, solved in one pass over all bodies and times.
+    """
+    semimajor = np.array([body.semimajor for body in bodies])[:, np.newaxis]
+    eccentricity = np.array([body.eccentricity for body in bodies])[:, np.newaxis]
+    motion = 2 * np.pi / np.array([body.period for body in bodies])[:, np.newaxis]
+    anomaly = eccentric_anomaly(np.remainder(motion * np.asarray(times, dtype=float), 2 * np.pi), eccentricity)
+    return np.stack((semimajor * (np.cos(anomaly) - eccentricity),
+                     semimajor * np.sqrt(1. - eccentricity ** 2) * np.sin(anomaly)), axis=-1)
+
+
+def positions(bodies: list[Celestial], times: np.ndarray) -> np.ndarray:
+    """(bodies, times, 2) positions in km from the root of their hierarchy (e.g. the Sun)"""
+    chain = with_primaries(bodies)
+    orbiting = [body for body in chain if body.orbits is not None]
+    offsets = orbit_offsets(orbiting, times) if orbiting else None
+    placed = np.zeros((len(chain), len(times), 2))
+    for index, body in enumerate(orbiting):  # primaries are placed first
+        placed[chain.index(body)] = placed[chain.index(body.orbits)] + offsets[index]
+    return placed[[chain.index(body) for body in bodies]]
+
+
+def lagrange_tracks(bodies: list[Celestial], times: np.ndarray) -> np.ndarray:
+    """(bodies, 5, times, 2) positions in km of L1-L5 of each body and its primary
+
+    The co-rotating solution is scaled and turned with the pair's separation at each time.
+    """
+    primary = positions([body.orbits for body in bodies], times)
+    separation = positions(bodies, times) - primary
+    m_1 = np.array([body.orbits.mass for body in bodies])
+    m_2 = np.array([body.mass for body in bodies])
+    q = np.maximum(m_1, m_2) / np.minimum(m_1, m_2)
+    xs, ys, _ = lagrange_points(q)
+    # lagrange_points is centred on the barycenter, with the primary at -1 / (q + 1)
+    along = (xs + 1 / (q + 1)[:, np.newaxis])[:, :, np.newaxis, np.newaxis]
+    across = ys[:, :, np.newaxis, np.newaxis]
+    leading = np.stack((-separation[..., 1], separation[..., 0]), axis=-1)[:, np.newaxis]
+    return primary[:, np.newaxis] + along * separation[:, np.newaxis] + across * leading
+
+
+def track_names(bodies: list[Celestial]) -> list[dict]:
+    """Descriptions of the tracks of bodies: the bodies, their primaries, then L1-L5 of each body"""
+    names = [dict(name=body.name, parent=body.orbits.name if body.orbits else None, kind='body')
+             for body in with_primaries(bodies)]
+    return names + [dict(name='%s %s' % (body.name, point.upper()), parent=body.name, kind=point)
+                    for body in bodies if body.orbits is not None for point in POINTS]
+
+
+def tracks(bodies: list[Celestial], times: np.ndarray) -> np.ndarray:
+    """float32 (times, tracks, 2) positions in km, in the order of track_names"""
+    chain = with_primaries(bodies)
+    orbiting = [body for body in bodies if body.orbits is not None]
+    frames = np.empty((len(times), len(chain) + len(POINTS) * len(orbiting), 2), dtype=np.float32)
+    frames[:, :len(chain)] = positions(chain, times).transpose(1, 0, 2)
+    if orbiting:
+        lagrange = lagrange_tracks(orbiting, times).reshape(len(POINTS) * len(orbiting), len(times), 2)
+        frames[:, len(chain):] = lagrange.transpose(1, 0, 2)
+    return frames
+
+
+def write_tracks(path: str, bodies: list[Celestial], start: float, step: float, count: int,
+                 chunk: int = 4096) -> str:
+    """Stream count frames, step seconds apart from start, to a track file
+
+    The file is TRACK_MAGIC, a little-endian uint32 header length and a JSON header, padded
+    to TRACK_ALIGN, then little-endian float32 frames of (tracks, 2) km positions in time
+    order, so a client can play frames back as they arrive. Frames are computed chunk at a time.
+    """
+    names = track_names(bodies)
+    header = json.dumps(dict(tracks=names, start=start, step=step, frames=count, units='km',
+                             dtype='<f4', shape=[count, len(names), 2])).encode()
+    header += b' ' * (-(len(TRACK_MAGIC) + 4 + len(header)) % TRACK_ALIGN)
+    with open(path, 'wb') as handle:
+        handle.write(TRACK_MAGIC + struct.pack('<I', len(header)) + header)
+        for first in range(0, count, chunk):
+            times = start + step * np.arange(first, min(first + chunk, count))
+            handle.write(tracks(bodies, times).astype('<f4', copy=False).tobytes())
+    return path
+
+
+def read_tracks(path: str) -> tuple[dict, np.ndarray]:
+    """Header and a memory-mapped (frames, tracks, 2) array of a track file"""
+    with open(path, 'rb') as handle:
+        if handle.read(len(TRACK_MAGIC)) != TRACK_MAGIC:
+            raise ValueError('Not a track file: %s' % path)
+        size, = struct.unpack('<I', handle.read(4))
+        header = json.loads(handle.read(size))
+    frames = np.memmap(path, dtype=header['dtype'], mode='r', offset=len(TRACK_MAGIC) + 4 + size,
+                       shape=tuple(header['shape']))
+    return header, frames
+
+
+def main(argv: list[str] = None, prog: str = None):
+    bodies = {body.name: body for body in Planets + Satellites}
+    parser = argparse.ArgumentParser(
+        prog=prog or os.path.basename(__file__),
+        description='Write position tracks of bodies and their Lagrange points for animation')
+    parser.add_argument('-o', '--output', type=str, default='orbits.trk', help='Track file')
+    parser.add_argument('--bodies', nargs='+', choices=list(bodies), default=list(bodies), help='Bodies to track')
+    parser.add_argument('--start', type=float, default=0., help='First frame in days from epoch')
+    parser.add_argument('--days', type=float, default=365.25, help='Time span in days')
+    parser.add_argument('--step', type=float, default=1., help='Days between frames')
+    args = parser.parse_args(argv)
+
+    count = int(args.days / args.step) + 1
+    path = write_tracks(args.output, [bodies[name] for name in args.bodies], args.start * DAY, args.step * DAY, count)
+    print('Saved %d frames to %s' % (count, path))
+
+
+if __name__ == "__main__":
+    main()
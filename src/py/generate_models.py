@@ -1,83 +1,255 @@
 import argparse
+import functools
+import io
 import os
 import subprocess
 
 import numpy as np
-import stl
-from stl import mesh
-from meshgrid2gltf import meshgrid_to_gltf
-
-try:
-    import surf2stl
-except ImportError:
-    import urllib.request
-    url = 'https://raw.githubusercontent.com/asahidari/surf2stl-python/refs/heads/master/surf2stl.py'
-    urllib.request.urlretrieve(url)
-    import surf2stl
-
+import grid_cache
+import instrument
+import kernels
+import parallel
+import roche_lagrangian
+import transforms
+
+from grid_cache import GridCache
+from manifest import Manifest, celestial_fields, code_version, digest
+from parallel import map_bodies
 from roche_lagrangian import RocheLagrangian
 from solar_constants import Planets, Satellites, Celestial
+from transforms import Clamp, ScaleOffset, Transforms
 
+# raw z to the heights of the model surfaces
+MESH_TRANSFORMS = Transforms(Clamp(.5), ScaleOffset(-1.5, -.75))
+# sampling density of the finest level of detail, halved each level after
+LOD_POINTS = 50
+# levels of detail before a level would have fewer than two points per axis
+MAX_LOD = int(np.log2(LOD_POINTS // 2)) + 1
 
 
-def _planet_to_mesh(planet: Celestial):
-    rl = RocheLagrangian(planet.orbits.mass, planet.mass, planet.semimajor)
-    scale = -1.5
+
+def _planet_to_mesh(planet: Celestial, cache: GridCache = None, points: int = 50, dtype: np.dtype = np.float64):
+    rl = RocheLagrangian(planet.orbits.mass, planet.mass, planet.semimajor, dtype)
     limit = .5
     radius = 1.725
-    v_x, v_y, v_z = rl.cartesian_sampling(50, radius=radius, limit=limit, mesh=True)
-    v_z = np.vectorize(lambda z: scale * (z if z < limit else limit) - .75)(v_z)
+    with instrument.stage('sample', body=planet.name) as counts:
+        # fused into the potential's pass when sampled afresh
+        v_x, v_y, v_z = rl.transformed_sampling(MESH_TRANSFORMS, points, radius=radius, limit=limit, cache=cache)
+        counts['samples'] = v_z.size
     return v_x, v_y, v_z
 
 
-def to_gltf(planet: Celestial, directory: str = os.getcwd()):  # Broken: stack exhaustion
-    target = os.path.join(directory, planet.name + '.glb')
-    x, y, z = _planet_to_mesh(planet)
+def _planet_to_lods(planet: Celestial, levels: int, cache: GridCache = None, dtype: np.dtype = np.float64):
+    """Adaptively sampled grids for each level of detail, halving the points each level"""
+    if not 1 <= levels <= MAX_LOD:
+        raise ValueError('Levels of detail must be from 1 to %d' % MAX_LOD)
+    rl = RocheLagrangian(planet.orbits.mass, planet.mass, planet.semimajor, dtype)
+    limit = .5
+    radius = 1.725
+    grids = []
+    with instrument.stage('sample', body=planet.name) as counts:
+        for level in range(levels):
+            v_x, v_y, v_z = rl.adaptive_sampling(LOD_POINTS // 2**level, radius=radius, limit=limit, z_limit=limit,
+                                                 cache=cache)
+            grids.append((v_x, v_y, MESH_TRANSFORMS.apply(v_z)))
+        counts['samples'] = sum(grid[2].size for grid in grids)
+    return grids
+
+
+def _planet_to_lobes(planet: Celestial, points: int = 96):
+    """L1 and L2 equipotential surfaces of the planet from a 3D potential volume"""
+    rl = RocheLagrangian(planet.orbits.mass, planet.mass, planet.semimajor)
+    with instrument.stage('lobes', body=planet.name) as counts:
+        lobes = rl.lobes(points)
+        counts['samples'] = 2 * points ** 3
+        counts['triangles'] = sum(len(indices) for _, _, indices in lobes.values())
+    return lobes
+
 
-    gltf = meshgrid_to_gltf([(x, y, z), (x, y, -z)])
-    gltf.save(target)
+def _save(target: str, model: bytes) -> str:
+    with open(target, 'wb') as handle:
+        handle.write(model)
     return target
 
 
-def to_stl(planet: Celestial, directory: str = os.getcwd()):
-    target = os.path.join(directory, planet.name + '.stl')
-    x, y, z = _planet_to_mesh(planet)
+def gltf_bytes(planet: Celestial, grid: tuple = None, quantize: bool = False, optimize: bool = False,
+               compress: bool = False, validate: bool = False) -> bytes:
+    x, y, z = grid if grid is not None else _planet_to_mesh(planet)
 
-    surf2stl.write(target + '_1', x, y, z)
-    surf2stl.write(target + '_2', x, y, -z)
-    stl_files = [target + '_1', target + '_2']
-    meshes = [mesh.Mesh.from_file(file) for file in stl_files]
-    combined = mesh.Mesh(np.concatenate([m.data for m in meshes]))
-    combined.save(target, mode=stl.Mode.BINARY)
-    os.remove(target + '_1')
-    os.remove(target + '_2')
-    return target
+    with instrument.stage('gltf', body=planet.name) as counts:
+        from meshgrid2gltf import glb_bytes, meshgrid_to_gltf  # glTF backends load only when building
+        model = glb_bytes(meshgrid_to_gltf([(x, y, z), (x, y, -z)], indexed=True, quantize=quantize,
+                                           optimize=optimize, compress=compress, validate=validate))
+        counts['bytes'] = len(model)
+    return model
+
+
+def gltf_lod_bytes(planet: Celestial, grid: list = None, quantize: bool = False, levels: int = 3,
+                   optimize: bool = False, compress: bool = False, validate: bool = False) -> bytes:
+    grids = grid if grid is not None else _planet_to_lods(planet, levels)
+
+    with instrument.stage('gltf', body=planet.name) as counts:
+        from meshgrid2gltf import glb_bytes, lods_to_gltf
+        model = glb_bytes(lods_to_gltf([[(x, y, z), (x, y, -z)] for x, y, z in grids], quantize=quantize,
+                                       optimize=optimize, compress=compress, validate=validate))
+        counts['bytes'] = len(model)
+    return model
+
+
+def gltf_3d_bytes(planet: Celestial, grid: dict = None, quantize: bool = False, optimize: bool = False,
+                  compress: bool = False, validate: bool = False) -> bytes:
+    lobes = grid if grid is not None else _planet_to_lobes(planet)
+
+    with instrument.stage('gltf', body=planet.name) as counts:
+        from meshgrid2gltf import glb_bytes, meshes_to_gltf
+        model = glb_bytes(meshes_to_gltf(list(lobes.values()), quantize=quantize, optimize=optimize,
+                                         compress=compress, validate=validate))
+        counts['bytes'] = len(model)
+    return model
+
+
+def stl_bytes(planet: Celestial, grid: tuple = None) -> bytes:
+    import stl
+    from stl import mesh
+    from meshgrid2gltf import grid_triangles
+
+    x, y, z = grid if grid is not None else _planet_to_mesh(planet)
+
+    with instrument.stage('stl', body=planet.name) as counts:
+        triangles = np.concatenate([grid_triangles(x, y, z), grid_triangles(x, y, -z)])
+        combined = mesh.Mesh(np.zeros(len(triangles), dtype=mesh.Mesh.dtype))
+        combined.vectors[:] = triangles
+        combined.update_normals()
+        handle = io.BytesIO()
+        combined.save(planet.name + '.stl', fh=handle, mode=stl.Mode.BINARY)
+        counts['triangles'] = len(triangles)
+        counts['bytes'] = handle.tell()
+    return handle.getvalue()
+
+
+def to_gltf(planet: Celestial, directory: str = os.getcwd(), quantize: bool = False, grid: tuple = None,
+            optimize: bool = False, compress: bool = False, validate: bool = False):
+    return _save(os.path.join(directory, planet.name + '.glb'),
+                 gltf_bytes(planet, grid, quantize, optimize, compress, validate))
 
 
-def to_gltf_via_stl(planet: Celestial, directory: str = os.getcwd()):
-    target = os.path.join(directory, planet.name + '.glb')
-    intermediate = to_stl(planet, directory=directory)
-    subprocess.run(['blender', '-b', '-P', 'stl2gltf.py', '--', intermediate, target],
-                   env={'BLENDER_EXTERN_DRACO_LIBRARY_PATH': '/usr/lib/x86_64-linux-gnu/libdraco.so'})
+def to_gltf_lod(planet: Celestial, directory: str = os.getcwd(), quantize: bool = False, levels: int = 3,
+                grid: list = None, optimize: bool = False, compress: bool = False, validate: bool = False):
+    return _save(os.path.join(directory, planet.name + '.glb'),
+                 gltf_lod_bytes(planet, grid, quantize, levels, optimize, compress, validate))
+
+
+def to_gltf_3d(planet: Celestial, directory: str = os.getcwd(), quantize: bool = False, grid: dict = None,
+               optimize: bool = False, compress: bool = False, validate: bool = False):
+    # alongside, not over, the height-field model of the same body
+    return _save(os.path.join(directory, planet.name + '_lobes.glb'),
+                 gltf_3d_bytes(planet, grid, quantize, optimize, compress, validate))
+
+
+def to_stl(planet: Celestial, directory: str = os.getcwd(), grid: tuple = None):
+    return _save(os.path.join(directory, planet.name + '.stl'), stl_bytes(planet, grid))
+
+
+def _stl_to_gltf(planet: Celestial, intermediate: str, target: str) -> str:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stl2gltf.py')
+    with instrument.stage('blender', body=planet.name):
+        subprocess.run(['blender', '-b', '-P', script, '--', intermediate, target],
+                       env={'BLENDER_EXTERN_DRACO_LIBRARY_PATH': '/usr/lib/x86_64-linux-gnu/libdraco.so'})
     return target
 
 
-if __name__ == "__main__":
+def to_gltf_via_stl(planet: Celestial, directory: str = os.getcwd(), grid: tuple = None):
+    return _stl_to_gltf(planet, to_stl(planet, directory, grid), os.path.join(directory, planet.name + '.glb'))
+
+
+# the model bytes each writer saves, built in the workers
+_BUILDERS = {to_gltf: gltf_bytes, to_gltf_lod: gltf_lod_bytes, to_gltf_3d: gltf_3d_bytes, to_stl: stl_bytes,
+             to_gltf_via_stl: stl_bytes}
+
+
+def _build_model(planet: Celestial, mesh, build, options: dict) -> bytes:
+    return build(planet, grid=mesh(planet), **options)
+
+
+def _model_inputs(planet: Celestial, func, options: dict, dtype: np.dtype) -> str:
+    version = code_version(_planet_to_mesh, _planet_to_lods, _planet_to_lobes, func, roche_lagrangian, kernels, 'kernels_numba',
+                           'isosurface', 'meshgrid2gltf', 'mesh_encoding', transforms)
+    return digest(celestial_fields(planet), func.__name__, options, np.dtype(dtype).name, MESH_TRANSFORMS.key(),
+                  version)
+
+
+def _generate(args: argparse.Namespace):
+    dtype = np.float32 if args.float32 else np.float64
+    encoding = dict(quantize=args.quantize, optimize=args.optimize, compress=args.meshopt)
+    func, extension, options = to_gltf, '.glb', encoding
+    if args.stl:
+        func, extension, options = to_stl, '.stl', {}
+    elif args.blender:
+        func, extension, options = to_gltf_via_stl, '.glb', {}
+    elif args.lod:
+        func, extension, options = to_gltf_lod, '.glb', dict(encoding, levels=args.lod)
+    elif args.three_d:
+        func, extension, options = to_gltf_3d, '_lobes.glb', encoding
+    # validating checks a model without changing it, so is left out of its inputs
+    build_options = dict(options, validate=args.validate) if func in (to_gltf, to_gltf_lod, to_gltf_3d) else options
+
+    bodies = Satellites + Planets if args.planets else Satellites
+    manifest = Manifest(args.directory)
+    pending = []
+    for body in bodies:
+        target = os.path.join(args.directory, body.name + extension)
+        if args.force or not manifest.up_to_date(target, _model_inputs(body, func, options, dtype)):
+            pending.append(body)
+        else:
+            print('%s is up to date' % target)
+
+    # sampling and meshing happen in the workers, file writes in this process
+    cache = grid_cache.from_arguments(args)
+    mesh_body = functools.partial(_planet_to_mesh, cache=cache, dtype=dtype)
+    if func is to_gltf_lod:
+        mesh_body = functools.partial(_planet_to_lods, levels=args.lod, cache=cache, dtype=dtype)
+    elif func is to_gltf_3d:
+        mesh_body = _planet_to_lobes
+    build = functools.partial(_build_model, mesh=mesh_body, build=_BUILDERS[func], options=build_options)
+    for body, model in map_bodies(build, pending, args.jobs):
+        target = os.path.join(args.directory, body.name + extension)
+        if func is to_gltf_via_stl:
+            _stl_to_gltf(body, _save(os.path.join(args.directory, body.name + '.stl'), model), target)
+        else:
+            _save(target, model)
+        manifest.record(target, _model_inputs(body, func, options, dtype))
+
+
+def main(argv: list[str] = None, prog: str = None):
     parser = argparse.ArgumentParser(
-        prog=os.path.basename(__file__),
+        prog=prog or os.path.basename(__file__),
         description='Create GLTF or STL model of planetary Lagrangians and Roche potentials')
     parser.add_argument('-C', '--directory', type=str, default=os.getcwd(), help='Directory to save plot')
     parser.add_argument('--gltf', action='store_true', help='Create GLTF model (default)')
     parser.add_argument('--stl', action='store_true', help='Create STL model')
-    args = parser.parse_args()
+    parser.add_argument('--blender', action='store_true', help='Create GLTF model by converting STL with Blender')
+    parser.add_argument('--quantize', action='store_true', help='Store GLTF attributes with KHR_mesh_quantization')
+    parser.add_argument('--optimize', action='store_true',
+                        help='Reorder GLTF triangles and vertices for the GPU vertex cache and fetch')
+    parser.add_argument('--meshopt', action='store_true',
+                        help='Compress GLTF buffers with EXT_meshopt_compression (implies --quantize)')
+    parser.add_argument('--validate', action='store_true', help='Decode each GLTF model and check it against its mesh')
+    parser.add_argument('--lod', type=int, default=0,
+                        help='Create GLTF model with N (1 to %d) adaptive levels of detail' % MAX_LOD)
+    parser.add_argument('--3d', dest='three_d', action='store_true',
+                        help='Create GLTF model of the 3D L1 and L2 equipotential surfaces as <Body>_lobes.glb')
+    parser.add_argument('--planets', action='store_true', help='Also create models of the planets')
+    parallel.add_arguments(parser, 'Mesh bodies')
+    grid_cache.add_arguments(parser)
+    parser.add_argument('--force', action='store_true', help='Rebuild models even if their inputs are unchanged')
+    parser.add_argument('--float32', action='store_true', help='Sample in single precision, halving grid memory')
+    instrument.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.lod and not 1 <= args.lod <= MAX_LOD:
+        parser.error('--lod must be from 1 to %d' % MAX_LOD)
+    with instrument.session_from(args):
+        _generate(args)
 
-    func = to_gltf_via_stl
-    if args.stl:
-        func = to_stl
-    elif args.gltf:
-        func = to_gltf
-
-    for s in Satellites:
-        func(s, args.directory)
-    #for p in Planets:
-    #    func(p)
+
+if __name__ == "__main__":
+    main()
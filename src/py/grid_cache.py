@@ -0,0 +1,108 @@
+import argparse
+import hashlib
+import json
+import os
+from typing import Iterator
+
+import numpy as np
+
+DEFAULT_DIRECTORY = os.environ.get('SUSTAINABLE_SPACE_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'sustainable-space', 'grids'))
+DEFAULT_MAX_BYTES = 2**30
+
+
+class GridCache:
+    """Content-addressed store of sampled grids as .npy files, memory-mapped on load
+
+    Least recently used entries are evicted once the directory exceeds max_bytes.
+    """
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*params) -> str:
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key: str) -> tuple[np.ndarray, ...] | None:
+        path = self._path(key)
+        try:
+            stacked = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)  # mtime orders eviction
+        except FileNotFoundError:  # evicted by another worker since; the mapping stays valid
+            pass
+        return tuple(stacked)
+
+    def put(self, key: str, arrays: tuple[np.ndarray, ...]) -> tuple[np.ndarray, ...]:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        partial = '%s.%d.tmp' % (path, os.getpid())
+        with open(partial, 'wb') as handle:
+            np.save(handle, np.stack(arrays))
+        os.replace(partial, path)  # atomic, so concurrent workers never see a torn file
+        self.evict(keep=key)
+        return self.get(key) or arrays
+
+    def put_tiles(self, key: str, shape: tuple[int, ...], tiles: Iterator[tuple[slice, np.ndarray, ...]],
+                  dtype: np.dtype = np.float64) -> tuple[np.ndarray, ...]:
+        """Stream (rows, arrays...) tiles straight into a cache file of the stacked shape
+
+        Only one tile is held in memory at a time; the result is memory-mapped, and is kept
+        even if it alone exceeds max_bytes.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        partial = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            grid = np.lib.format.open_memmap(partial, mode='w+', dtype=dtype, shape=shape)
+            for band, *arrays in tiles:
+                for index, array in enumerate(arrays):
+                    grid[index, band] = array
+            grid.flush()
+            del grid
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        # mapped before evicting, so the mapping survives even another worker's eviction
+        stacked = tuple(np.load(path, mmap_mode='r'))
+        self.evict(keep=key)
+        return stacked
+
+    def evict(self, keep: str = None):
+        """Remove least recently used entries until the directory fits max_bytes, sparing the entry keep"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') and name != '%s.npy' % keep:
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:  # evicted by another worker since listing
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def add_arguments(parser: argparse.ArgumentParser, no_cache: str = 'Always resample grids'):
+    """--cache, --cache-size and --no-cache; no_cache describes what happens without the cache"""
+    parser.add_argument('--cache', type=str, default=DEFAULT_DIRECTORY, help='Directory caching sampled grids')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // 2**20, help='Cache size limit in MiB')
+    parser.add_argument('--no-cache', action='store_true', help=no_cache)
+
+
+def from_arguments(args: argparse.Namespace) -> GridCache | None:
+    """The cache add_arguments describes, or None with --no-cache"""
+    return None if args.no_cache else GridCache(args.cache, args.cache_size * 2**20)
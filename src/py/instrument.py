@@ -0,0 +1,129 @@
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from typing import Iterator
+
+_enabled = False
+_events = []
+_bodies = []  # enclosing body names, so nested stages are attributed to their body
+
+
+def enable(on: bool = True):
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def peak_rss() -> int:
+    """High-water mark of this process's resident memory in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+@contextlib.contextmanager
+def stage(name: str, body: str = None) -> Iterator[dict]:
+    """Time a pipeline stage; the yielded dict collects counts such as vertices or samples
+
+    Does nothing unless enabled. Stages nest, and inherit the body of an enclosing stage.
+    """
+    counts = {}
+    if not _enabled:
+        yield counts
+        return
+    body = body or (_bodies[-1] if _bodies else None)
+    _bodies.append(body)
+    ts = time.time_ns() // 1000
+    start = time.perf_counter_ns()
+    try:
+        yield counts
+    finally:
+        _bodies.pop()
+        _events.append(dict(name=name, body=body, pid=os.getpid(), ts=ts,
+                            dur=(time.perf_counter_ns() - start) // 1000, counts=counts, rss=peak_rss()))
+
+
+def drain() -> list[dict]:
+    """Remove and return the events recorded so far"""
+    events = _events[:]
+    _events.clear()
+    return events
+
+
+def merge(events: list[dict]):
+    """Add events recorded in another process"""
+    _events.extend(events)
+
+
+def report(events: list[dict]) -> dict:
+    """Per-stage and per-body totals: calls, seconds, summed counts and peak RSS"""
+    stages, bodies = {}, {}
+    for event in events:
+        total = stages.setdefault(event['name'], dict(calls=0, seconds=0., rss=0, counts={}))
+        total['calls'] += 1
+        total['seconds'] += event['dur'] / 1e6
+        total['rss'] = max(total['rss'], event['rss'])
+        for key, value in event['counts'].items():
+            total['counts'][key] = total['counts'].get(key, 0) + value
+        if event['body'] is not None:
+            per_body = bodies.setdefault(event['body'], {})
+            per_body[event['name']] = per_body.get(event['name'], 0.) + event['dur'] / 1e6
+    return dict(stages=stages, bodies=bodies)
+
+
+def write_report(path: str, events: list[dict]):
+    with open(path, 'w') as f:
+        json.dump(report(events), f, indent=2)
+
+
+def write_trace(path: str, events: list[dict]):
+    """Chrome trace-event JSON, viewable in chrome://tracing or Perfetto"""
+    trace = [dict(name=event['name'], cat=event['body'] or '', ph='X', ts=event['ts'], dur=event['dur'],
+                  pid=event['pid'], tid=event['pid'], args=dict(event['counts'], rss=event['rss']))
+             for event in events]
+    with open(path, 'w') as f:
+        json.dump(dict(traceEvents=trace, displayTimeUnit='ms'), f)
+
+
+@contextlib.contextmanager
+def session(report_path: str = None, trace_path: str = None, cprofile_path: str = None):
+    """Record stages while the block runs, writing whichever outputs have a path
+
+    The cProfile dump covers this process only; use a single job to profile sampling too.
+    """
+    if report_path or trace_path:
+        enable()
+    profiler = cProfile.Profile() if cprofile_path else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        events = drain()
+        enable(False)
+        if report_path:
+            write_report(report_path, events)
+        if trace_path:
+            write_trace(trace_path, events)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """--profile, --trace and --cprofile, the outputs of session"""
+    parser.add_argument('--profile', type=str, default=None, help='Write per-stage timings to a JSON report')
+    parser.add_argument('--trace', type=str, default=None, help='Write per-stage timings as trace events')
+    parser.add_argument('--cprofile', type=str, default=None, help='Write a cProfile dump of this process')
+
+
+def session_from(args: argparse.Namespace):
+    """session writing the outputs add_arguments parsed"""
+    return session(args.profile, args.trace, args.cprofile)
@@ -0,0 +1,108 @@
+import itertools
+from typing import Callable
+
+import numpy as np
+
+# cube corners numbered by their (dx, dy, dz) offset bits, dx being the most significant
+_OFFSETS = np.array([((corner >> 2) & 1, (corner >> 1) & 1, corner & 1) for corner in range(8)])
+# Freudenthal split: six tetrahedra around the 0-7 diagonal, so neighbouring cubes share face diagonals
+_TETS = np.array([[0, 4 >> a, (4 >> a) | (4 >> b), 7] for a, b, _ in itertools.permutations(range(3))])
+
+
+def _tet_cases() -> tuple[np.ndarray, np.ndarray]:
+    """Up to two triangles per inside-corner bitmask, each vertex an (inside, outside) corner pair"""
+    table = np.zeros((16, 2, 3, 2), dtype=int)
+    count = np.zeros(16, dtype=int)
+    for code in range(16):
+        inside = [corner for corner in range(4) if code >> corner & 1]
+        outside = [corner for corner in range(4) if not code >> corner & 1]
+        if len(inside) == 1:
+            table[code, 0] = [(inside[0], other) for other in outside]
+            count[code] = 1
+        elif len(inside) == 3:
+            table[code, 0] = [(other, outside[0]) for other in inside]
+            count[code] = 1
+        elif len(inside) == 2:
+            (a, b), (c, d) = inside, outside
+            table[code, 0] = [(a, c), (a, d), (b, d)]
+            table[code, 1] = [(a, c), (b, d), (b, c)]
+            count[code] = 2
+    return table, count
+
+
+_TABLE, _COUNT = _tet_cases()
+
+
+def isosurface(field: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+               gradient: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+               xs: np.ndarray, ys: np.ndarray, zs: np.ndarray, level: float,
+               slab: int = 16, closed: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Indexed triangles (points, normals, indices) where field crosses level on a rectilinear grid
+
+    Marching tetrahedra over slabs of x layers, so only one slab of the field is held at a
+    time. Vertices on the same grid edge are shared; triangles face increasing field, and
+    normals are the normalized gradient (an (n, 3) array for x, y, z arrays). closed counts
+    the boundary of the grid as outside, capping surfaces the grid cuts through on the boundary.
+    """
+    nx, ny, nz = len(xs), len(ys), len(zs)
+    strides = _OFFSETS @ np.array([ny * nz, nz, 1])
+    keys, positions = [], []
+    for start in range(0, nx - 1, slab):
+        stop = min(start + slab, nx - 1)
+        values = field(*np.meshgrid(xs[start:stop + 1], ys, zs, indexing='ij'))
+        if closed:
+            # raised to the level, so caps lie on the boundary samples themselves
+            for border in ((slice(None), [0, -1]), (slice(None), slice(None), [0, -1]),
+                           [index - start for index in (0, nx - 1) if start <= index <= stop]):
+                values[border] = np.maximum(values[border], level)
+        inside = values < level
+        corners = [inside[dx:dx + stop - start, dy:dy + ny - 1, dz:dz + nz - 1] for dx, dy, dz in _OFFSETS]
+        # only cubes the level passes through from here on
+        total = np.sum(corners, axis=0, dtype=np.uint8)
+        a, j, k = np.nonzero((total > 0) & (total < 8))
+        local = (a * ny + j) * nz + k  # into values, which starts at layer start
+        cube_corners = local[:, np.newaxis] + strides  # (cubes, 8)
+        tet_corners = cube_corners[:, _TETS]  # (cubes, 6, 4)
+        code = np.sum(inside.ravel()[tet_corners] << np.arange(4), axis=-1)
+        tet_corners, code = tet_corners[(code > 0) & (code < 15)], code[(code > 0) & (code < 15)]
+
+        for slot in range(2):
+            emit = _COUNT[code] > slot
+            pairs = _TABLE[code[emit], slot]  # (triangles, 3, 2) tetrahedron corners
+            ends = np.take_along_axis(tet_corners[emit], pairs.reshape(-1, 6), axis=1).reshape(-1, 3, 2)
+            v = values.ravel()[ends]
+            ends += start * ny * nz  # global grid indices of each (inside, outside) pair
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # nan only when the inside end is -inf (e.g. on a point mass), so the crossing is at the other
+                t = np.nan_to_num(np.clip((level - v[..., 0]) / (v[..., 1] - v[..., 0]), 0., 1.), nan=1.)
+            i_x, i_y, i_z = ends // (ny * nz), ends // nz % ny, ends % nz
+            ends_xyz = np.stack((xs[i_x], ys[i_y], zs[i_z]), axis=-1)  # (triangles, 3, 2, 3)
+            points = ends_xyz[:, :, 0] + t[..., np.newaxis] * (ends_xyz[:, :, 1] - ends_xyz[:, :, 0])
+
+            # face the triangles along inside -> outside, i.e. increasing field, judged from the
+            # edge midpoints since crossings on a sample can collapse the triangle itself
+            middle = ends_xyz.mean(axis=2)
+            normal = np.cross(middle[:, 1] - middle[:, 0], middle[:, 2] - middle[:, 0])
+            outward = np.sum(ends_xyz[:, :, 1] - ends_xyz[:, :, 0], axis=1)
+            flip = np.einsum('ij,ij->i', normal, outward) < 0
+            points[flip] = points[flip][:, ::-1]
+            ends[flip] = ends[flip][:, ::-1]
+            t[flip] = t[flip][:, ::-1]
+            # crossings on a sample are keyed by the sample, so every edge meeting there shares them
+            low = np.where(t == 1., ends[..., 1], ends.min(axis=-1))
+            high = np.where(t == 0., ends[..., 0], ends.max(axis=-1))
+            keys.append(low * (nx * ny * nz) + high)
+            positions.append(points)
+
+    if not keys:
+        return np.zeros((0, 3)), np.zeros((0, 3)), np.zeros((0, 3), dtype=int)
+    keys, first, indices = np.unique(np.concatenate(keys).ravel(), return_index=True, return_inverse=True)
+    points = np.concatenate(positions).reshape(-1, 3)[first]
+    indices = indices.reshape(-1, 3)
+    # triangles collapsed onto a shared edge vertex
+    indices = indices[(indices[:, 0] != indices[:, 1]) & (indices[:, 1] != indices[:, 2])
+                      & (indices[:, 0] != indices[:, 2])]
+    normals = gradient(points[:, 0], points[:, 1], points[:, 2])
+    norm = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, norm, out=normals, where=norm > 0)
+    return points, normals, indices
@@ -0,0 +1,122 @@
+import functools
+import os
+
+import numpy as np
+
+# environment variable forcing the numba kernels on (1) or off (0)
+NUMBA_VARIABLE = 'SUSTAINABLE_SPACE_NUMBA'
+NUMBA_MIN_SAMPLES = 2**24
+
+
+def roche_potential(x1, x2, x, y):
+    return (-x2 / np.sqrt(np.power(x - x1, 2) + np.power(y, 2))) \
+        + (x1 / np.sqrt(np.power(x - x2, 2) + np.power(y, 2))) \
+        - 0.5 * (np.power(x, 2) + np.power(y, 2))
+
+
+def roche_potential_3d(x1, x2, x, y, z):
+    """roche_potential off the orbital plane; the centrifugal term has no z component"""
+    yz2 = np.square(y) + np.square(z)
+    return -x2 / np.sqrt(np.square(x - x1) + yz2) + x1 / np.sqrt(np.square(x - x2) + yz2) \
+        - 0.5 * (np.square(x) + np.square(y))
+
+
+def roche_gradient_3d(x1, x2, x, y, z) -> np.ndarray:
+    """(n, 3) gradient of roche_potential_3d"""
+    yz2 = np.square(y) + np.square(z)
+    w1 = x2 / np.power(np.square(x - x1) + yz2, 1.5)
+    w2 = -x1 / np.power(np.square(x - x2) + yz2, 1.5)
+    return np.stack((w1 * (x - x1) + w2 * (x - x2) - x, (w1 + w2 - 1.) * y, (w1 + w2) * z), axis=-1)
+
+
+def roche_potential_compact(x1, x2, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """roche_potential over grids in their own dtype, reusing two full-size buffers
+
+    Squared distances are floored at the smallest normal number, so samples on a mass
+    give a large finite potential rather than overflowing a narrow type.
+    """
+    tiny = np.finfo(x.dtype).tiny
+    y2 = np.square(y)
+    phi = np.subtract(x, x1)
+    buffer = np.subtract(x, x2)
+    for r, mass in ((phi, -x2), (buffer, x1)):
+        np.square(r, out=r)
+        r += y2
+        np.maximum(r, tiny, out=r)
+        np.sqrt(r, out=r)
+        np.divide(mass, r, out=r)
+    phi += buffer
+    np.square(x, out=buffer)
+    buffer += y2
+    buffer *= 0.5
+    phi -= buffer
+    return phi
+
+
+def _roche_log_log_numpy(x1, x2, x: np.ndarray, y: np.ndarray, limit: float, scale: float,
+                         offset: float) -> np.ndarray:
+    if x.dtype == np.float64:
+        # the potential diverges at the masses; those samples become inf
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.log10(np.log10(np.fabs(roche_potential(x1, x2, x, y))))
+    else:
+        z = roche_potential_compact(x1, x2, x, y)
+        for func in (np.fabs, np.log10, np.log10):
+            func(z, out=z)
+    if limit < np.inf:
+        np.minimum(z, limit, out=z)
+    if scale != 1.:
+        z *= scale
+    if offset:
+        z += offset
+    return z
+
+
+@functools.cache
+def _numba_kernels():
+    """kernels_numba, imported (with numba) on first use, or None if numba is not installed"""
+    try:
+        import kernels_numba
+    except ImportError:
+        return None
+    return kernels_numba
+
+
+def use_numba(samples: int) -> bool:
+    """Whether grids of this many samples go to the numba kernels
+
+    The NUMBA_VARIABLE environment variable (1 or 0) forces the choice; otherwise only grids
+    of at least NUMBA_MIN_SAMPLES do, as loading numba and starting its threads costs more
+    than it saves on smaller ones.
+    """
+    choice = os.environ.get(NUMBA_VARIABLE)
+    if choice is not None:
+        return choice.strip().lower() not in ('', '0', 'false', 'no')
+    return samples >= NUMBA_MIN_SAMPLES
+
+
+def roche_log_log(x1, x2, x: np.ndarray, y: np.ndarray, limit: float = np.inf, scale: float = 1.,
+                  offset: float = 0.) -> np.ndarray:
+    """min(log10(log10(|roche_potential|)), limit) * scale + offset over grids, in the dtype of x
+
+    With numba (see use_numba) this is a multithreaded pass computed in the dtype of x
+    (samples on a mass become inf, and are then clamped). Without SVML, numba's log10 is
+    scalar and several times slower than numpy's, so the logarithms are then taken by numpy
+    in between.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x), np.asarray(y))
+    compiled = _numba_kernels() if use_numba(x.size) else None
+    if compiled is None:
+        return _roche_log_log_numpy(x1, x2, x, y, limit, scale, offset)
+    x1, x2, limit, scale, offset = [x.dtype.type(value) for value in (x1, x2, limit, scale, offset)]
+    out = np.empty(x.shape, dtype=x.dtype)
+    flat_x, flat_y, flat_out = np.ascontiguousarray(x).reshape(-1), np.ascontiguousarray(y).reshape(-1), out.reshape(-1)
+    if compiled.numba.config.USING_SVML:
+        compiled.roche_log_log(x1, x2, flat_x, flat_y, limit, scale, offset, flat_out)
+        return out
+    compiled.roche_magnitude(x1, x2, flat_x, flat_y, flat_out)
+    with np.errstate(divide='ignore'):
+        np.log10(out, out=out)
+        np.log10(out, out=out)
+    compiled.clamp_scale_offset(flat_out, limit, scale, offset)
+    return out
@@ -0,0 +1,29 @@
+import numba
+import numpy as np
+
+# compiled kernels behind kernels.roche_log_log, imported only for grids large enough to pay for numba
+
+
+@numba.njit(parallel=True, error_model='numpy', cache=True)
+def roche_log_log(x1, x2, x, y, limit, scale, offset, out):
+    for i in numba.prange(x.size):
+        y2 = y[i] * y[i]
+        d1 = x[i] - x1
+        d2 = x[i] - x2
+        phi = -x2 / np.sqrt(d1 * d1 + y2) + x1 / np.sqrt(d2 * d2 + y2) - 0.5 * (x[i] * x[i] + y2)
+        out[i] = min(np.log10(np.log10(abs(phi))), limit) * scale + offset
+
+
+@numba.njit(parallel=True, error_model='numpy', cache=True)
+def roche_magnitude(x1, x2, x, y, out):
+    for i in numba.prange(x.size):
+        y2 = y[i] * y[i]
+        d1 = x[i] - x1
+        d2 = x[i] - x2
+        out[i] = abs(-x2 / np.sqrt(d1 * d1 + y2) + x1 / np.sqrt(d2 * d2 + y2) - 0.5 * (x[i] * x[i] + y2))
+
+
+@numba.njit(parallel=True, cache=True)
+def clamp_scale_offset(z, limit, scale, offset):
+    for i in numba.prange(z.size):
+        z[i] = min(z[i], limit) * scale + offset
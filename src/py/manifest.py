@@ -0,0 +1,62 @@
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+
+from solar_constants import Celestial
+
+MANIFEST = '.manifest.json'
+
+
+def digest(*inputs) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+def celestial_fields(body: Celestial | None) -> dict | None:
+    """Fields of a body and, recursively, of the bodies it orbits"""
+    if body is None:
+        return None
+    return dict(name=body.name, mass=body.mass, radius=body.radius, semimajor=body.semimajor,
+                orbits=celestial_fields(body.orbits))
+
+
+def celestial_from_fields(fields: dict | None) -> Celestial | None:
+    """The body celestial_fields describes"""
+    if fields is None:
+        return None
+    return Celestial(fields['name'], float(fields['mass']), float(fields['radius']), float(fields['semimajor']),
+                     celestial_from_fields(fields.get('orbits')))
+
+
+def _source(obj) -> str:
+    if isinstance(obj, str):  # a module name, read without importing the module
+        with open(importlib.util.find_spec(obj).origin) as handle:
+            return handle.read()
+    return inspect.getsource(obj)
+
+
+def code_version(*objects) -> str:
+    """Hash of the source of the functions, classes or modules (objects or names) producing an output"""
+    return digest(*[_source(obj) for obj in objects])
+
+
+class Manifest:
+    """Input hashes of generated files, kept as JSON next to the outputs"""
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, MANIFEST)
+        try:
+            with open(self.path) as handle:
+                self.entries = json.load(handle)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def up_to_date(self, target: str, inputs: str) -> bool:
+        return os.path.exists(target) and self.entries.get(os.path.basename(target)) == inputs
+
+    def record(self, target: str, inputs: str):
+        self.entries[os.path.basename(target)] = inputs
+        partial = self.path + '.tmp'
+        with open(partial, 'w') as handle:
+            json.dump(self.entries, handle, indent=2, sort_keys=True)
+        os.replace(partial, self.path)
@@ -0,0 +1,180 @@
+import argparse
+import functools
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import grid_cache
+import parallel
+from contours import simplify
+from grid_cache import GridCache
+from parallel import map_bodies, map_items
+from roche_lagrangian import RocheLagrangian, planet_system, row_bands
+from solar_constants import Celestial, Planets
+
+TILE_SIZE = 256
+POINTS = 500
+# grids are sampled, scanned and traced this many rows at a time, so none is loaded whole
+ROWS = 256
+
+
+def _annulus(planet: Celestial, points: int) -> tuple[tuple[float, float], float, float]:
+    """Centre, inner and outer radius, in km, of the plotted grid of a planet, placed as in the plot"""
+    rl = planet_system(planet)
+    p_x, _ = rl._polar_axes(points)
+    return rl.origin, rl.adjust(p_x.min()), rl.adjust(p_x.max())
+
+
+def tile_bounds(zoom: int, column: int, row: int, extent: float) -> tuple[float, float, float, float]:
+    """(x0, y0, x1, y1) in km of a slippy-map tile; row 0 is the top of a map spanning +-extent"""
+    width = 2. * extent / 2**zoom
+    return -extent + column * width, extent - (row + 1) * width, -extent + (column + 1) * width, extent - row * width
+
+
+def _overlaps(annulus: tuple[tuple[float, float], float, float], bounds: tuple[float, float, float, float]) -> bool:
+    (c_x, c_y), inner, outer = annulus
+    x0, y0, x1, y1 = bounds[0] - c_x, bounds[1] - c_y, bounds[2] - c_x, bounds[3] - c_y
+    nearest = np.hypot(np.clip(0., x0, x1), np.clip(0., y0, y1))
+    furthest = np.hypot(max(abs(x0), abs(x1)), max(abs(y0), abs(y1)))
+    return nearest <= outer and furthest >= inner
+
+
+def _crop(samples: tuple[np.ndarray, ...], rl: RocheLagrangian,
+          bounds: tuple[float, float, float, float]) -> tuple[np.ndarray, ...] | None:
+    """Smallest index window of a sampled grid covering the tile, or None if nothing falls inside"""
+    raw_x, raw_y, _ = samples
+    (c_x, c_y), scale = rl.origin, rl.adjust(1.)
+    x0, x1 = (bounds[0] - c_x) / scale, (bounds[2] - c_x) / scale
+    y0, y1 = (bounds[1] - c_y) / scale, (bounds[3] - c_y) / scale
+    rows, columns = [], np.zeros(raw_x.shape[1], dtype=bool)
+    for band in row_bands(len(raw_x), ROWS):
+        band_x, band_y = raw_x[band], raw_y[band]
+        inside = (band_x >= x0) & (band_x <= x1) & (band_y >= y0) & (band_y <= y1)
+        rows.append(np.flatnonzero(inside.any(axis=1)) + band.start)
+        columns |= inside.any(axis=0)
+    rows, columns = np.unique(np.concatenate(rows)), np.flatnonzero(columns)
+    if len(rows) == 0:
+        return None
+    # one extra sample each side so fills reach the tile edge
+    rows = slice(max(rows[0] - 1, 0), rows[-1] + 2)
+    columns = slice(max(columns[0] - 1, 0), columns[-1] + 2)
+    return tuple(array[rows, columns] for array in samples)
+
+
+def _render_tile(tile: tuple[int, int, int], planets: list[Celestial], points: int, extent: float,
+                 ranges: dict[str, tuple[float, float]], cache: GridCache, directory: str, image_format: str) -> str:
+    from matplotlib.figure import Figure
+
+    zoom, column, row = tile
+    bounds = tile_bounds(zoom, column, row, extent)
+    fig = Figure(figsize=(1, 1), dpi=TILE_SIZE)
+    ax = fig.add_axes((0, 0, 1, 1))
+    for planet in planets:
+        if not _overlaps(_annulus(planet, points), bounds):
+            continue
+        rl = planet_system(planet)
+        samples = _crop(rl.plot_samples(points, cache=cache, tile_rows=ROWS), rl, bounds)
+        if samples is not None:
+            rl.plot(ax, with_text=False, samples=samples, verbose=False, z_range=ranges[planet.name])
+    ax.set_axis_off()
+    ax.set_xlim(bounds[0], bounds[2])
+    ax.set_ylim(bounds[1], bounds[3])
+    path = os.path.join(directory, str(zoom), str(column), '%d.%s' % (row, image_format))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fig.savefig(path, format=image_format)
+    return path
+
+
+def _clip(line: np.ndarray, bounds: tuple[float, float, float, float]) -> list[np.ndarray]:
+    """Runs of a polyline inside the tile, each extended by one point to cross the tile edge"""
+    x0, y0, x1, y1 = bounds
+    inside = (line[:, 0] >= x0) & (line[:, 0] <= x1) & (line[:, 1] >= y0) & (line[:, 1] <= y1)
+    # widen by one point each way so segments leaving the tile are kept
+    near = inside.copy()
+    near[1:] |= inside[:-1]
+    near[:-1] |= inside[1:]
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], near.astype(np.int8), [0]))))
+    return [line[start:stop] for start, stop in zip(edges[::2], edges[1::2]) if stop - start > 1]
+
+
+def write_vector_tiles(lines: dict[str, dict[str, list[np.ndarray]]], tiles: list[tuple[int, int, int]],
+                       extent: float, directory: str):
+    """Per tile JSON of the clipped contours, simplified to about a pixel"""
+    for zoom, column, row in tiles:
+        bounds = tile_bounds(zoom, column, row, extent)
+        tolerance = (bounds[2] - bounds[0]) / TILE_SIZE
+        features = []
+        for body, levels in lines.items():
+            for level, polylines in levels.items():
+                for polyline in polylines:
+                    for run in _clip(polyline, bounds):
+                        features.append(dict(body=body, level=level, points=simplify(run, tolerance).tolist()))
+        path = os.path.join(directory, str(zoom), str(column), '%d.json' % row)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            json.dump(dict(bounds=bounds, lines=features), handle)
+
+
+def render_map_tiles(directory: str = os.getcwd(), max_zoom: int = 3, points: int = POINTS, image_format: str = 'png',
+                     jobs: int = 1, cache: GridCache = None) -> str:
+    """Slippy-map pyramid of the solar system plot: raster tiles plus simplified vector contours
+
+    Without a cache, grids go through a temporary one removed once the tiles are written.
+    """
+    if cache is None:
+        with tempfile.TemporaryDirectory(prefix='tiles-') as temporary:
+            return render_map_tiles(directory, max_zoom, points, image_format, jobs, GridCache(temporary))
+    directory = os.path.join(directory, 'tiles')
+    extent = max(np.hypot(*center) + outer for center, _, outer in (_annulus(planet, points) for planet in Planets))
+
+    # sample every planet once into the cache; tile workers memory-map the grids
+    ranges, lines = {}, {}
+    sample = functools.partial(_sample_to_cache, points=points, cache=cache)
+    for planet, _ in map_bodies(sample, Planets, jobs):
+        rl = planet_system(planet)
+        samples = rl.plot_samples(points, cache=cache, tile_rows=ROWS)
+        z_min, z_max = np.inf, -np.inf
+        for band in row_bands(len(samples[2]), ROWS):
+            z = rl._plot_z(samples[2][band], False)
+            z_min, z_max = min(z_min, float(np.min(z))), max(z_max, float(np.max(z)))
+        ranges[planet.name] = (z_min, z_max)
+        lines[planet.name] = rl.equipotentials(samples=samples, tile_rows=ROWS)
+
+    tiles = [(zoom, column, row) for zoom in range(max_zoom + 1)
+             for column in range(2**zoom) for row in range(2**zoom)]
+    render = functools.partial(_render_tile, planets=Planets, points=points, extent=extent, ranges=ranges,
+                               cache=cache, directory=directory, image_format=image_format)
+    for _ in map_items(render, tiles, jobs):
+        pass
+    write_vector_tiles(lines, tiles, extent, directory)
+
+    with open(os.path.join(directory, 'metadata.json'), 'w') as handle:
+        json.dump(dict(extent=extent, tile_size=TILE_SIZE, min_zoom=0, max_zoom=max_zoom, format=image_format,
+                       bodies=[planet.name for planet in Planets]), handle, indent=2)
+    return directory
+
+
+def _sample_to_cache(planet: Celestial, points: int, cache: GridCache):
+    planet_system(planet).plot_samples(points, cache=cache, tile_rows=ROWS)
+
+
+def main(argv: list[str] = None, prog: str = None):
+    parser = argparse.ArgumentParser(
+        prog=prog or os.path.basename(__file__),
+        description='Render the solar system Roche potentials as a slippy-map tile pyramid')
+    parser.add_argument('-C', '--directory', type=str, default=os.getcwd(), help='Directory to save tiles under')
+    parser.add_argument('--zoom', type=int, default=3, help='Deepest zoom level')
+    parser.add_argument('--points', type=int, default=POINTS, help='Sampling density of each planet')
+    parser.add_argument('--format', type=str, default='png', choices=['png', 'webp'], help='Raster tile format')
+    parallel.add_arguments(parser, 'Render tiles')
+    grid_cache.add_arguments(parser, 'Resample grids into a temporary cache')
+    args = parser.parse_args(argv)
+
+    print("Saved to %s" % render_map_tiles(args.directory, args.zoom, args.points, args.format, args.jobs,
+                                           grid_cache.from_arguments(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import functools
+
+import numpy as np
+import pygltflib
+
+MESHOPT = 'EXT_meshopt_compression'
+
+_COMPONENTS = {pygltflib.BYTE: np.int8, pygltflib.UNSIGNED_BYTE: np.uint8, pygltflib.SHORT: np.int16,
+               pygltflib.UNSIGNED_SHORT: np.uint16, pygltflib.UNSIGNED_INT: np.uint32, pygltflib.FLOAT: np.float32}
+_WIDTHS = {pygltflib.SCALAR: 1, pygltflib.VEC2: 2, pygltflib.VEC3: 3, pygltflib.VEC4: 4}
+
+
+@functools.cache
+def _meshoptimizer():
+    """meshoptimizer, imported on first use, or None if it is not installed"""
+    try:
+        import meshoptimizer
+    except ImportError:
+        return None
+    return meshoptimizer
+
+
+def _morton(cells: np.ndarray) -> np.ndarray:
+    """Z-order keys of (n, 3) integer cells below 2**10"""
+    key = np.zeros(len(cells), dtype=np.int64)
+    for bit in range(10):
+        for axis in range(3):
+            key |= ((cells[:, axis] >> bit) & 1) << (3 * bit + axis)
+    return key
+
+
+def cache_order(points: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """indices with triangles reordered so consecutive ones share vertices
+
+    meshoptimizer's vertex cache optimizer when installed, otherwise a Z-order sort of the
+    triangle centroids, which keeps neighbouring triangles together.
+    """
+    meshoptimizer = _meshoptimizer()
+    if meshoptimizer is not None and len(indices):
+        ordered = np.empty(indices.size, dtype=np.uint32)
+        meshoptimizer.optimize_vertex_cache(ordered, indices.ravel(), indices.size, len(points))
+        return ordered.reshape(-1, 3).astype(indices.dtype)
+    centroids = points[indices].mean(axis=1)
+    low, high = centroids.min(axis=0, initial=0.), centroids.max(axis=0, initial=0.)
+    cells = ((centroids - low) / np.where(high > low, high - low, 1.) * 1023).astype(np.int64)
+    return indices[np.argsort(_morton(cells), kind='stable')]
+
+
+def fetch_order(indices: np.ndarray, vertex_count: int) -> tuple[np.ndarray, np.ndarray]:
+    """(order, indices): vertices renumbered by first use, so order[new] is the old index
+
+    Vertices no triangle uses are kept, at the end.
+    """
+    flat = indices.ravel()
+    _, first = np.unique(flat, return_index=True)
+    used = flat[np.sort(first)]
+    order = np.concatenate((used, np.setdiff1d(np.arange(vertex_count), used, assume_unique=True)))
+    renumber = np.empty(vertex_count, dtype=indices.dtype)
+    renumber[order] = np.arange(vertex_count, dtype=indices.dtype)
+    return order, renumber[indices]
+
+
+def optimize_mesh(points: np.ndarray, normals: np.ndarray,
+                  indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(points, normals, indices, order) reordered for the vertex cache, then for vertex fetch"""
+    order, indices = fetch_order(cache_order(points, indices), len(points))
+    return points[order], normals[order], indices, order
+
+
+def oct_encode(normals: np.ndarray, bits: int = 8) -> np.ndarray:
+    """(n, 4) int8 octahedral normals as EXT_meshopt_compression's OCTAHEDRAL filter decodes them"""
+    top = (1 << (bits - 1)) - 1
+    total = np.abs(normals).sum(axis=1)
+    scale = np.divide(1., total, out=np.zeros_like(total), where=total > 0)
+    x, y, z = normals[:, 0] * scale, normals[:, 1] * scale, normals[:, 2]
+    sign_x, sign_y = np.where(x >= 0, 1., -1.), np.where(y >= 0, 1., -1.)
+    u = np.where(z >= 0, x, (1. - np.abs(y)) * sign_x)
+    v = np.where(z >= 0, y, (1. - np.abs(x)) * sign_y)
+    encoded = np.zeros((len(normals), 4), dtype=np.int8)
+    encoded[:, 0] = np.trunc(np.clip(u, -1., 1.) * top + np.where(u >= 0, .5, -.5))
+    encoded[:, 1] = np.trunc(np.clip(v, -1., 1.) * top + np.where(v >= 0, .5, -.5))
+    encoded[:, 2] = top
+    return encoded
+
+
+def oct_decode(encoded: np.ndarray) -> np.ndarray:
+    """The OCTAHEDRAL filter: (n, 4) int8 octahedral normals to (n, 4) int8 normalized ones
+
+    As the extension's reference decoder; SIMD decoders approximate the length, and may
+    differ by one.
+    """
+    x, y = encoded[:, 0].astype(np.float32), encoded[:, 1].astype(np.float32)
+    z = encoded[:, 2].astype(np.float32) - np.abs(x) - np.abs(y)
+    t = np.minimum(z, np.float32(0.))
+    x += np.where(x >= 0, t, -t)
+    y += np.where(y >= 0, t, -t)
+    scale = np.float32(127.) / np.sqrt(x * x + y * y + z * z)
+    decoded = encoded.copy()
+    for axis, value in enumerate((x, y, z)):
+        value = value * scale
+        decoded[:, axis] = np.trunc(value + np.where(value >= 0, np.float32(.5), np.float32(-.5)))
+    return decoded
+
+
+def encode_view(data: np.ndarray, mode: str, vertex_count: int = None) -> tuple[bytes, int, int]:
+    """(compressed bytes, element count, byte stride) of a view in an EXT_meshopt_compression mode"""
+    meshoptimizer = _meshoptimizer()
+    if meshoptimizer is None:
+        raise ImportError('meshoptimizer is required for %s' % MESHOPT)
+    data = np.ascontiguousarray(data)
+    if mode == 'TRIANGLES':
+        meshoptimizer.encode_index_version(1)
+        return meshoptimizer.encode_index_buffer(data.ravel(), data.size, vertex_count), data.size, data.itemsize
+    meshoptimizer.encode_vertex_version(0)  # the only version the extension allows
+    stride = data.nbytes // len(data)
+    return meshoptimizer.encode_vertex_buffer(data.view(np.uint8).reshape(len(data), stride)), len(data), stride
+
+
+def _view_bytes(gltf: pygltflib.GLTF2, blob: bytes, index: int) -> tuple[bytes, int]:
+    """Uncompressed bytes and stride of a buffer view"""
+    view = gltf.bufferViews[index]
+    compressed = (view.extensions or {}).get(MESHOPT)
+    if compressed is None:
+        return blob[view.byteOffset or 0:(view.byteOffset or 0) + view.byteLength], view.byteStride
+    meshoptimizer = _meshoptimizer()
+    if meshoptimizer is None:
+        raise ImportError('meshoptimizer is required to decode %s' % MESHOPT)
+    data = blob[compressed['byteOffset']:compressed['byteOffset'] + compressed['byteLength']]
+    count, stride = compressed['count'], compressed['byteStride']
+    if compressed['mode'] == 'TRIANGLES':
+        # decoded as 32 bits, which is what the binding's output array holds whatever the stride
+        decoded = meshoptimizer.decode_index_buffer(count, 4, data)
+        return decoded.astype({2: np.uint16, 4: np.uint32}[stride]).tobytes(), stride
+    decoded = meshoptimizer.decode_vertex_buffer(count, stride, data, dtype=np.dtype((np.uint8, stride)))
+    if compressed.get('filter') == 'OCTAHEDRAL':
+        decoded = oct_decode(decoded.view(np.int8))
+    return decoded.tobytes(), stride
+
+
+def _read_accessor(gltf: pygltflib.GLTF2, blob: bytes, index: int) -> np.ndarray:
+    """Accessor values as floats, normalized integers scaled to [-1, 1] or [0, 1]"""
+    accessor = gltf.accessors[index]
+    dtype = np.dtype(_COMPONENTS[accessor.componentType])
+    width = _WIDTHS[accessor.type]
+    data, stride = _view_bytes(gltf, blob, accessor.bufferView)
+    stride = stride or dtype.itemsize * width
+    rows = np.frombuffer(data, dtype=np.uint8, count=accessor.count * stride,
+                         offset=accessor.byteOffset or 0).reshape(accessor.count, stride)
+    values = rows[:, :dtype.itemsize * width].copy().view(dtype).reshape(accessor.count, width)
+    if accessor.normalized:
+        return np.maximum(values / float(np.iinfo(dtype).max), -1.)
+    return values.astype(float) if dtype.kind == 'f' else values
+
+
+def decode_gltf(gltf: pygltflib.GLTF2) -> list[tuple[np.ndarray, np.ndarray, np.ndarray | None]]:
+    """(points, normals, indices) of each node's mesh, with node scale and translation applied"""
+    blob = gltf.binary_blob()
+    meshes = []
+    for node in gltf.nodes:
+        primitive = gltf.meshes[node.mesh].primitives[0]
+        points = _read_accessor(gltf, blob, primitive.attributes.POSITION)
+        if node.scale is not None:
+            points = points * node.scale
+        if node.translation is not None:
+            points = points + node.translation
+        normals = _read_accessor(gltf, blob, primitive.attributes.NORMAL)
+        indices = None
+        if primitive.indices is not None:
+            indices = _read_accessor(gltf, blob, primitive.indices).reshape(-1, 3).astype(np.int64)
+        meshes.append((points, normals, indices))
+    return meshes
+
+
+def _canonical(indices: np.ndarray) -> np.ndarray:
+    """Triangles rotated to start at their lowest index (keeping the winding), then sorted"""
+    shift = np.argmin(indices, axis=1)
+    rotated = np.take_along_axis(indices, (shift[:, np.newaxis] + np.arange(3)) % 3, axis=1)
+    return rotated[np.lexsort(rotated.T[::-1])]
+
+
+def validate(gltf: pygltflib.GLTF2, sources: list[tuple], position_tolerance: float = 1e-4,
+             normal_tolerance: float = .02) -> dict[str, float]:
+    """Decode gltf and compare each node with its source (points, normals, indices, order)
+
+    order maps each encoded vertex to its source vertex (None if unchanged). Positions may
+    differ by position_tolerance of the mesh's largest half extent, unit normals by
+    normal_tolerance per component, and the triangles, winding included, must match exactly.
+    Raises ValueError on a mismatch; returns the largest errors found.
+    """
+    decoded = decode_gltf(gltf)
+    if len(decoded) != len(sources):
+        raise ValueError('%d meshes decoded, %d expected' % (len(decoded), len(sources)))
+    worst = dict(position=0., normal=0.)
+    for number, ((points, normals, indices), (source_points, source_normals, source_indices, order)) \
+            in enumerate(zip(decoded, sources)):
+        order = np.arange(len(source_points)) if order is None else order
+        if len(points) != len(source_points):
+            raise ValueError('mesh %d: %d vertices, %d expected' % (number, len(points), len(source_points)))
+        extent = float(np.max(np.ptp(source_points, axis=0)) / 2.) or 1.
+        position = float(np.max(np.abs(points - source_points[order]), initial=0.)) / extent
+        unit = np.linalg.norm(normals, axis=1, keepdims=True)
+        normal = float(np.max(np.abs(np.divide(normals, unit, out=np.zeros_like(normals), where=unit > 0)
+                                     - source_normals[order]), initial=0.))
+        if position > position_tolerance:
+            raise ValueError('mesh %d: positions off by %g of the extent' % (number, position))
+        if normal > normal_tolerance:
+            raise ValueError('mesh %d: normals off by %g' % (number, normal))
+        if (indices is None) != (source_indices is None) or (
+                indices is not None and not np.array_equal(_canonical(order[indices]), _canonical(source_indices))):
+            raise ValueError('mesh %d: triangles differ' % number)
+        worst = dict(position=max(worst['position'], position), normal=max(worst['normal'], normal))
+    return worst
@@ -1,117 +1,330 @@
-import resource
-import sys
+import struct
 
 import numpy as np
 import pygltflib
 
-resource.setrlimit(resource.RLIMIT_STACK, (2**29,-1))
-sys.setrecursionlimit(10**6)
-
-def _normalize(vector):
-    norm = 0
-    for i in range(0, len(vector)):
-        norm += vector[i] * vector [i]
-    norm = np.sqrt(norm)
-    for i in range(0, len(vector)):
-        vector[i] = vector[i] / norm
-    return vector
-
-def _local_find_normal(p1, p2, p3):
-    v1 = p2 - p1
-    v2 = p3 - p1
-    v3 = np.cross(v1, v2)
-    n = v3 / np.sqrt(np.sum(v3*v3))
-    return n
-
-
-def meshgrid_to_gltf(meshes: list[tuple[np.ndarray, np.ndarray, np.ndarray]]):
-    points = []
-    normals = []
-
-    for mesh in meshes:
-        x, y, z = mesh
-        if z.ndim != 2:
-            raise Exception('Variable z must be a 2-dimensional array')
-
-        if len(x.shape) == 1 and x.shape[0] == z.shape[1] \
-                and len(y.shape) == 1 and y.shape[0] == z.shape[0]:
-            x, y = np.meshgrid(x, y)
-
-        if len(x.shape) != len(z.shape) \
-                or len(y.shape) != len(z.shape) \
-                or x.shape[1] != z.shape[1] \
-                or y.shape[0] != z.shape[0]:
-            raise Exception('Unable to resolve x and y variables')
-
-        for i in range(z.shape[0]-1):
-            for j in range(z.shape[1]-1):
-                p1 = np.array([x[i,j], y[i,j], z[i,j]])
-                points.append(p1)
-                p2 = np.array([x[i,j+1], y[i,j+1], z[i,j+1]])
-                points.append(p1)
-                p3 = np.array([x[i+1,j+1], y[i+1,j+1], z[i+1,j+1]])
-                points.append(p1)
-                norm = _local_find_normal(p1, p2, p3)
-                #norm = _normalize(norm)
-                normals.append(norm)
-                normals.append(norm)
-                normals.append(norm)
-
-    points = np.array(points, dtype="float32")
-    normals = np.array(normals, dtype="float32")
-    points_binary_blob = points.tobytes()
-    normals_binary_blob = normals.tobytes()
-
-    gltf = pygltflib.GLTF2(
-        scene=0,
-        scenes=[pygltflib.Scene(nodes=[0])],
-        nodes=[pygltflib.Node(mesh=0)],
-        meshes=[
+import instrument
+from mesh_encoding import MESHOPT, encode_view, oct_encode, optimize_mesh, validate as validate_gltf
+
+
+def _resolve_grid(mesh: tuple[np.ndarray, np.ndarray, np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    x, y, z = mesh
+    if z.ndim != 2:
+        raise Exception('Variable z must be a 2-dimensional array')
+
+    if len(x.shape) == 1 and x.shape[0] == z.shape[1] \
+            and len(y.shape) == 1 and y.shape[0] == z.shape[0]:
+        x, y = np.meshgrid(x, y)
+
+    if len(x.shape) != len(z.shape) \
+            or len(y.shape) != len(z.shape) \
+            or x.shape[1] != z.shape[1] \
+            or y.shape[0] != z.shape[0]:
+        raise Exception('Unable to resolve x and y variables')
+    return x, y, z
+
+
+def grid_indexed(x: np.ndarray, y: np.ndarray, z: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Shared vertices (n, 3) and triangle indices (m, 3) of a structured grid"""
+    x, y, z = _resolve_grid((x, y, z))
+    rows, cols = z.shape
+    points = np.stack((x, y, z), axis=-1).reshape(-1, 3)
+    index = np.arange(rows * cols).reshape(rows, cols)
+    i00 = index[:-1, :-1].ravel()
+    i01 = index[:-1, 1:].ravel()
+    i11 = index[1:, 1:].ravel()
+    i10 = index[1:, :-1].ravel()
+    indices = np.concatenate((np.stack((i00, i01, i11), axis=1),
+                              np.stack((i00, i11, i10), axis=1)))
+    return points, indices
+
+
+def grid_triangles(x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """Triangles of a structured grid as an (n, 3, 3) array, two per quad"""
+    points, indices = grid_indexed(x, y, z)
+    return points[indices]
+
+
+def face_normals(triangles: np.ndarray) -> np.ndarray:
+    """Unit normals of (n, 3, 3) triangles; degenerate faces get a zero normal"""
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    norm = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, norm, out=normals, where=norm > 0)
+    return normals
+
+
+def vertex_normals(points: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Area-weighted unit normals per vertex of an indexed (m, 3) triangle list"""
+    corners = points[indices]
+    # unnormalized cross products are twice the face area, so their sum is area-weighted
+    faces = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    normals = np.zeros_like(points)
+    for axis in range(3):
+        normals[:, axis] = np.bincount(indices.ravel(), weights=np.repeat(faces[:, axis], 3),
+                                       minlength=len(points))
+    norm = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, norm, out=normals, where=norm > 0)
+    return normals
+
+
+def _pad(blob: bytes) -> bytes:
+    return blob + b'\x00' * (-len(blob) % 4)
+
+
+def _quantize_positions(points: np.ndarray) -> tuple[np.ndarray, list[float], float]:
+    """int16 positions (padded to 4 components) with the node translation and uniform scale decoding them"""
+    low, high = points.min(axis=0), points.max(axis=0)
+    center = (low + high) / 2.
+    scale = float(np.max(high - low) / 2.) or 1.
+    quantized = np.zeros((len(points), 4), dtype="int16")
+    quantized[:, :3] = np.round((points - center) / scale * 32767)
+    return quantized, center.tolist(), scale
+
+
+def _quantize_normals(normals: np.ndarray) -> np.ndarray:
+    """int8 normals (padded to 4 components) for normalized BYTE accessors"""
+    quantized = np.zeros((len(normals), 4), dtype="int8")
+    quantized[:, :3] = np.round(np.clip(normals, -1., 1.) * 127)
+    return quantized
+
+
+def _require(extensions: list[str], name: str):
+    if name not in extensions:
+        extensions.append(name)
+
+
+class _GltfBuilder:
+    """Accumulates meshes and their binary data into a single-buffer GLB
+
+    With compress, views are stored with EXT_meshopt_compression and normals oct-encoded;
+    their uncompressed layout lives in a second, data-less fallback buffer. sources records
+    what each node was built from, for validate.
+    """
+    def __init__(self, compress: bool = False):
+        self.gltf = pygltflib.GLTF2(scene=0, scenes=[pygltflib.Scene(nodes=[])])
+        self._blobs = []
+        self._length = 0
+        self._fallback = 0
+        self.compress = compress
+        self.sources = []
+
+    def _append(self, blob: bytes) -> int:
+        offset = self._length
+        self._blobs.append(_pad(blob))
+        self._length += len(self._blobs[-1])
+        return offset
+
+    def _view(self, data: np.ndarray, target: int, stride: int = None, mode: str = None, filter: str = None,
+              vertex_count: int = None) -> int:
+        data = np.ascontiguousarray(data)
+        if self.compress and mode is not None:
+            blob, count, encoded_stride = encode_view(data, mode, vertex_count)
+            compressed = dict(buffer=0, byteOffset=self._append(blob), byteLength=len(blob),
+                              byteStride=encoded_stride, count=count, mode=mode)
+            if filter is not None:
+                compressed['filter'] = filter
+            view = pygltflib.BufferView(buffer=1, byteOffset=self._fallback, byteLength=data.nbytes,
+                                        byteStride=stride, target=target, extensions={MESHOPT: compressed})
+            self._fallback += data.nbytes + (-data.nbytes % 4)
+        else:
+            offset = self._append(data.tobytes())
+            view = pygltflib.BufferView(buffer=0, byteOffset=offset, byteLength=len(self._blobs[-1]),
+                                        byteStride=stride, target=target)
+        self.gltf.bufferViews.append(view)
+        return len(self.gltf.bufferViews) - 1
+
+    def _accessor(self, data: np.ndarray, target: int, component: int, accessor_type: str, count: int,
+                  stride: int = None, normalized: bool = False, bounds: bool = False, mode: str = None,
+                  filter: str = None, vertex_count: int = None) -> int:
+        accessor = pygltflib.Accessor(
+            bufferView=self._view(data, target, stride, mode, filter, vertex_count),
+            componentType=component,
+            count=count,
+            type=accessor_type,
+            normalized=normalized or None,
+        )
+        if bounds:
+            values = data[:, :3]
+            accessor.max = values.max(axis=0).tolist()
+            accessor.min = values.min(axis=0).tolist()
+        self.gltf.accessors.append(accessor)
+        return len(self.gltf.accessors) - 1
+
+    def add_mesh(self, points: np.ndarray, normals: np.ndarray, indices: np.ndarray = None,
+                 quantize: bool = False, root: bool = True, optimize: bool = False) -> int:
+        """Add a mesh and a node instancing it, returning the node index
+
+        optimize reorders triangles for the vertex cache and vertices for fetching.
+        Compressing builders always quantize.
+        """
+        order = None
+        if optimize and indices is not None:
+            source = points, normals, indices
+            points, normals, indices, order = optimize_mesh(points, normals, indices)
+            self.sources.append(source + (order,))
+        else:
+            self.sources.append((points, normals, indices, None))
+        node = pygltflib.Node(mesh=len(self.gltf.meshes))
+        if quantize or self.compress:
+            quantized, node.translation, scale = _quantize_positions(points)
+            node.scale = [scale] * 3
+            position = self._accessor(quantized, pygltflib.ARRAY_BUFFER, pygltflib.SHORT, pygltflib.VEC3,
+                                      len(points), stride=8, normalized=True, bounds=True, mode='ATTRIBUTES')
+            if self.compress:
+                normal = self._accessor(oct_encode(normals), pygltflib.ARRAY_BUFFER, pygltflib.BYTE,
+                                        pygltflib.VEC3, len(normals), stride=4, normalized=True,
+                                        mode='ATTRIBUTES', filter='OCTAHEDRAL')
+            else:
+                normal = self._accessor(_quantize_normals(normals), pygltflib.ARRAY_BUFFER, pygltflib.BYTE,
+                                        pygltflib.VEC3, len(normals), stride=4, normalized=True)
+            for extensions in (self.gltf.extensionsUsed, self.gltf.extensionsRequired):
+                _require(extensions, 'KHR_mesh_quantization')
+        else:
+            position = self._accessor(points.astype("float32"), pygltflib.ARRAY_BUFFER, pygltflib.FLOAT,
+                                      pygltflib.VEC3, len(points), bounds=True)
+            normal = self._accessor(normals.astype("float32"), pygltflib.ARRAY_BUFFER, pygltflib.FLOAT,
+                                    pygltflib.VEC3, len(normals))
+
+        index_accessor = None
+        if indices is not None:
+            if len(points) < 2**16 - 1:  # 65535 is reserved for primitive restart
+                indices, component = indices.astype("uint16"), pygltflib.UNSIGNED_SHORT
+            else:
+                indices, component = indices.astype("uint32"), pygltflib.UNSIGNED_INT
+            index_accessor = self._accessor(indices, pygltflib.ELEMENT_ARRAY_BUFFER, component,
+                                            pygltflib.SCALAR, indices.size, mode='TRIANGLES',
+                                            vertex_count=len(points))
+
+        self.gltf.meshes.append(
             pygltflib.Mesh(
                 primitives=[
                     pygltflib.Primitive(
-                        attributes=pygltflib.Attributes(POSITION=0, NORMAL=1), indices=None
+                        attributes=pygltflib.Attributes(POSITION=position, NORMAL=normal), indices=index_accessor
                     )
                 ]
             )
-        ],
-        accessors=[
-            pygltflib.Accessor(
-                bufferView=0,
-                componentType=pygltflib.FLOAT,
-                count=len(points),
-                type=pygltflib.VEC3,
-                max=points.max(axis=0).tolist(),
-                min=points.min(axis=0).tolist(),
-            ),
-            pygltflib.Accessor(
-                bufferView=1,
-                componentType=pygltflib.FLOAT,
-                count=len(normals),
-                type=pygltflib.VEC3,
-                max=None,
-                min=None,
-            ),
-        ],
-        bufferViews=[
-            pygltflib.BufferView(
-                buffer=0,
-                byteOffset=0,
-                byteLength=len(points_binary_blob),
-                target=pygltflib.ARRAY_BUFFER,
-            ),
-            pygltflib.BufferView(
-                buffer=0,
-                byteOffset=len(points_binary_blob),
-                byteLength=len(normals_binary_blob),
-                target=pygltflib.ARRAY_BUFFER,
-            ),
-        ],
-        buffers=[
-            pygltflib.Buffer(
-                byteLength=len(points_binary_blob) + len(normals_binary_blob)
-            )
-        ],
-    )
-    gltf.set_binary_blob(points_binary_blob + normals_binary_blob)
+        )
+        self.gltf.nodes.append(node)
+        index = len(self.gltf.nodes) - 1
+        if root:
+            self.gltf.scenes[0].nodes.append(index)
+        return index
+
+    def add_lods(self, node: int, levels: list[int], coverage: list[float]):
+        """Mark lower-detail nodes as MSFT_lod alternatives of a root node"""
+        self.gltf.nodes[node].extensions = {'MSFT_lod': {'ids': levels}}
+        self.gltf.nodes[node].extras = {'MSFT_screencoverage': coverage}
+        _require(self.gltf.extensionsUsed, 'MSFT_lod')
+
+    def build(self) -> pygltflib.GLTF2:
+        with instrument.stage('pack') as counts:
+            self.gltf.buffers = [pygltflib.Buffer(byteLength=self._length)]
+            if self._fallback:
+                self.gltf.buffers.append(pygltflib.Buffer(byteLength=self._fallback,
+                                                          extensions={MESHOPT: {'fallback': True}}))
+                for extensions in (self.gltf.extensionsUsed, self.gltf.extensionsRequired):
+                    _require(extensions, MESHOPT)
+            self.gltf.set_binary_blob(b''.join(self._blobs))
+            counts['bytes'] = self._length
+        return self.gltf
+
+    def validate(self, gltf: pygltflib.GLTF2):
+        """Check the decoded gltf against the meshes it was built from, raising ValueError if they differ"""
+        with instrument.stage('validate'):
+            validate_gltf(gltf, self.sources)
+
+
+def _grids_to_arrays(meshes: list[tuple[np.ndarray, np.ndarray, np.ndarray]],
+                     indexed: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    with instrument.stage('mesh') as counts:
+        points, normals, indices = _assemble(meshes, indexed)
+        counts['vertices'] = len(points)
+        counts['triangles'] = len(points) // 3 if indices is None else len(indices)
+    return points, normals, indices
+
+
+def _assemble(meshes: list[tuple[np.ndarray, np.ndarray, np.ndarray]],
+              indexed: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if indexed:
+        points, indices, offset = [], [], 0
+        for mesh in meshes:
+            p, i = grid_indexed(*mesh)
+            points.append(p)
+            indices.append(i + offset)
+            offset += len(p)
+        points = np.concatenate(points)
+        indices = np.concatenate(indices)
+        return points, vertex_normals(points, indices), indices
+
+    triangles = np.concatenate([grid_triangles(*mesh) for mesh in meshes])
+    normals = np.repeat(face_normals(triangles), 3, axis=0)
+    return triangles.reshape(-1, 3), normals, None
+
+
+def glb_bytes(gltf: pygltflib.GLTF2) -> bytes:
+    """A built GLB as laid out
+
+    pygltflib's save repacks every buffer view into one buffer, which would discard the
+    EXT_meshopt_compression fallback buffer; uncompressed output is the same either way.
+    """
+    document = gltf.gltf_to_json(separators=(',', ':'), indent=None).encode('utf-8')
+    document += b' ' * (-len(document) % 4)
+    blob = _pad(gltf.binary_blob() or b'')
+    return b''.join((struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(document) + 8 + len(blob)),
+                     struct.pack('<I4s', len(document), b'JSON'), document,
+                     struct.pack('<I4s', len(blob), b'BIN\x00'), blob))
+
+
+def save_glb(gltf: pygltflib.GLTF2, path: str) -> str:
+    with open(path, 'wb') as handle:
+        handle.write(glb_bytes(gltf))
+    return path
+
+
+def _finish(builder: _GltfBuilder, validate: bool) -> pygltflib.GLTF2:
+    gltf = builder.build()
+    if validate:
+        builder.validate(gltf)
     return gltf
+
+
+def meshgrid_to_gltf(meshes: list[tuple[np.ndarray, np.ndarray, np.ndarray]], indexed: bool = False,
+                     quantize: bool = False, optimize: bool = False, compress: bool = False, validate: bool = False):
+    """GLB of structured grids, optionally indexed and with KHR_mesh_quantization attributes
+
+    optimize reorders indexed meshes for the vertex cache and fetch, compress (implying
+    quantize, and needing meshoptimizer) adds EXT_meshopt_compression, and validate decodes
+    the result and checks it against the input.
+    """
+    builder = _GltfBuilder(compress)
+    builder.add_mesh(*_grids_to_arrays(meshes, indexed), quantize=quantize, optimize=optimize)
+    return _finish(builder, validate)
+
+
+def meshes_to_gltf(meshes: list[tuple[np.ndarray, np.ndarray, np.ndarray]], quantize: bool = False,
+                   optimize: bool = False, compress: bool = False, validate: bool = False):
+    """GLB of indexed (points, normals, indices) meshes, one node each; options as for meshgrid_to_gltf"""
+    builder = _GltfBuilder(compress)
+    for points, normals, indices in meshes:
+        builder.add_mesh(points, normals, indices, quantize=quantize, optimize=optimize)
+    return _finish(builder, validate)
+
+
+def lods_to_gltf(levels: list[list[tuple[np.ndarray, np.ndarray, np.ndarray]]], indexed: bool = True,
+                 quantize: bool = False, coverage: list[float] = None, optimize: bool = False,
+                 compress: bool = False, validate: bool = False):
+    """GLB of the same grids at decreasing detail, linked with MSFT_lod
+
+    Viewers without MSFT_lod render the first (most detailed) level. coverage gives the
+    screen fraction below which each level hands over to the next; it defaults to halving.
+    Other options as for meshgrid_to_gltf.
+    """
+    builder = _GltfBuilder(compress)
+    nodes = [builder.add_mesh(*_grids_to_arrays(meshes, indexed), quantize=quantize, root=index == 0,
+                              optimize=optimize)
+             for index, meshes in enumerate(levels)]
+    if len(nodes) > 1:
+        if coverage is None:
+            coverage = [0.5 ** index for index in range(1, len(nodes))] + [0.]
+        builder.add_lods(nodes[0], nodes[1:], coverage)
+    return _finish(builder, validate)
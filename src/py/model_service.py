@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from generate_models import _planet_to_lobes, _planet_to_mesh
+from manifest import celestial_fields, celestial_from_fields, digest
+from meshgrid2gltf import glb_bytes, meshes_to_gltf, meshgrid_to_gltf
+from solar_constants import Celestial, Planets, Satellites, Sun
+
+KINDS = ('grid', '3d')
+OPTIONS = ('quantize', 'optimize', 'compress')
+DEFAULT_MAX_BYTES = 256 * 2**20
+# request bodies larger than this are refused
+MAX_REQUEST = 2**16
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+          500: 'Internal Server Error'}
+
+
+def build_model(fields: dict, kind: str, options: dict) -> bytes:
+    """GLB of the body celestial_fields describes, as generate_models would write it"""
+    body = celestial_from_fields(fields)
+    if kind == '3d':
+        gltf = meshes_to_gltf(list(_planet_to_lobes(body).values()), **options)
+    else:
+        x, y, z = _planet_to_mesh(body)
+        gltf = meshgrid_to_gltf([(x, y, z), (x, y, -z)], indexed=True, **options)
+    return glb_bytes(gltf)
+
+
+def parse_body(fields: dict) -> Celestial:
+    """A posted body: name, mass (kg), radius and semimajor (km), and orbits, the name of a known
+    body or the fields of another posted one"""
+    known = {body.name: body for body in [Sun] + Planets + Satellites}
+    if not isinstance(fields, dict):
+        raise ValueError('A body must be an object')
+    orbits = fields.get('orbits', Sun.name)
+    if isinstance(orbits, str):
+        if orbits not in known:
+            raise ValueError('Unknown body %r' % orbits)
+        orbits = known[orbits]
+    else:
+        orbits = parse_body(orbits)
+    try:
+        body = Celestial(str(fields['name']), float(fields['mass']), float(fields['radius']),
+                         float(fields['semimajor']), orbits)
+    except KeyError as missing:
+        raise ValueError('Missing field %s' % missing)
+    except (TypeError, ValueError):
+        raise ValueError('mass, radius and semimajor must be numbers')
+    if not (body.mass > 0 and body.radius > 0 and body.semimajor > 0):
+        raise ValueError('mass, radius and semimajor must be positive')
+    return body
+
+
+class ModelService:
+    """Builds models on demand in a worker pool, without blocking the event loop
+
+    Concurrent requests for the same model share one build, and finished models are kept
+    in memory, least recently used first out once they exceed max_bytes.
+    """
+
+    def __init__(self, jobs: int = 1, max_bytes: int = DEFAULT_MAX_BYTES, executor: Executor = None):
+        self.max_bytes = max_bytes
+        self.executor = executor or ProcessPoolExecutor(max_workers=jobs if jobs > 0 else os.cpu_count() or 1)
+        self.models = OrderedDict()
+        self.pending = {}
+        self.stats = dict(hits=0, misses=0, coalesced=0, evictions=0)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _store(self, key: str, future: asyncio.Future):
+        del self.pending[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.models[key] = future.result()
+        while sum(len(model) for model in self.models.values()) > self.max_bytes and len(self.models) > 1:
+            self.models.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    async def model(self, body: Celestial, kind: str = 'grid', **options) -> bytes:
+        """GLB of body; options as for meshgrid_to_gltf"""
+        if kind not in KINDS:
+            raise ValueError('kind must be one of %s' % ', '.join(KINDS))
+        fields = celestial_fields(body)
+        key = digest(fields, kind, options)
+        if key in self.models:
+            self.models.move_to_end(key)
+            self.stats['hits'] += 1
+            return self.models[key]
+        future = self.pending.get(key)
+        if future is None:
+            self.stats['misses'] += 1
+            future = asyncio.get_running_loop().run_in_executor(self.executor, build_model, fields, kind, options)
+            self.pending[key] = future
+            future.add_done_callback(functools.partial(self._store, key))
+        else:
+            self.stats['coalesced'] += 1
+        # a caller giving up must not cancel the build for the others
+        return await asyncio.shield(future)
+
+    def describe(self) -> dict:
+        return dict(self.stats, models=len(self.models), bytes=sum(len(model) for model in self.models.values()),
+                    pending=len(self.pending))
+
+    async def handle(self, method: str, path: str, content: bytes) -> tuple[int, str, bytes]:
+        """(status, content type, body) of a request
+
+        POST /model with a JSON object of body (see parse_body), kind and the boolean options
+        returns the GLB; GET /stats the cache counters.
+        """
+        if path == '/stats':
+            if method != 'GET':
+                return _error(405, 'Use GET')
+            return 200, 'application/json', json.dumps(self.describe()).encode()
+        if path != '/model':
+            return _error(404, 'No such path %s' % path)
+        if method != 'POST':
+            return _error(405, 'Use POST')
+        try:
+            request = json.loads(content or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('The request must be an object')
+            body = parse_body(request.get('body'))
+            kind = request.get('kind', 'grid')
+            options = {name: bool(request.get(name, False)) for name in OPTIONS}
+            if kind not in KINDS:
+                raise ValueError('kind must be one of %s' % ', '.join(KINDS))
+        except ValueError as error:  # json.JSONDecodeError included
+            return _error(400, str(error))
+        try:
+            model = await self.model(body, kind, **options)
+        except Exception as error:
+            return _error(500, '%s: %s' % (type(error).__name__, error))
+        return 200, 'model/gltf-binary', model
+
+
+def _error(status: int, message: str) -> tuple[int, str, bytes]:
+    return status, 'application/json', json.dumps(dict(error=message)).encode()
+
+
+class LocalClient:
+    """Requests straight to a service's handler, for testing without a socket"""
+
+    def __init__(self, service: ModelService):
+        self.service = service
+
+    async def request(self, method: str, path: str, payload: dict = None) -> tuple[int, str, bytes]:
+        content = json.dumps(payload).encode() if payload is not None else b''
+        return await self.service.handle(method, path, content)
+
+    async def model(self, body: dict, kind: str = 'grid', **options) -> bytes:
+        status, _, content = await self.request('POST', '/model', dict(options, body=body, kind=kind))
+        if status != 200:
+            raise RuntimeError('%d %s' % (status, json.loads(content)['error']))
+        return content
+
+
+async def _respond(service: ModelService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serve one HTTP/1.1 request, then close the connection"""
+    try:
+        method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while (line := (await reader.readline()).decode('latin-1').strip()):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_REQUEST:
+            status, kind, content = _error(413, 'Requests are limited to %d bytes' % MAX_REQUEST)
+        else:
+            status, kind, content = await service.handle(method, path.split('?', 1)[0],
+                                                         await reader.readexactly(length))
+    except (ValueError, asyncio.IncompleteReadError):
+        status, kind, content = _error(400, 'Malformed request')
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                  % (status, STATUS[status], kind, len(content))).encode('latin-1') + content)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, jobs: int = 1, max_bytes: int = DEFAULT_MAX_BYTES):
+    async with ModelService(jobs, max_bytes) as service:
+        server = await asyncio.start_server(functools.partial(_respond, service), host, port)
+        print('Serving models on http://%s:%d/model' % (host, port))
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv: list[str] = None, prog: str = None):
+    parser = argparse.ArgumentParser(
+        prog=prog or os.path.basename(__file__),
+        description='Serve GLTF models of posted bodies over HTTP')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 for all cores)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // 2**20,
+                        help='Memory for finished models in MiB')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.jobs, args.cache_size * 2**20))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
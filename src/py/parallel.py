@@ -0,0 +1,50 @@
+import argparse
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import instrument
+from solar_constants import Celestial
+
+Item = TypeVar('Item')
+
+
+def _instrumented(func: Callable[[Item], object], item: Item) -> tuple[object, list[dict]]:
+    instrument.enable()
+    return func(item), instrument.drain()
+
+
+def map_items(func: Callable[[Item], object], items: Iterable[Item], jobs: int = 1) -> Iterator[tuple[Item, object]]:
+    """Yield (item, func(item)) in order, fanning out over a process pool when jobs != 1
+
+    jobs of 0 (or less) uses every core. func must be picklable, i.e. a module-level
+    function or a functools.partial of one. Stages instrumented in the workers are merged
+    into this process's events.
+    """
+    items = list(items)
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        if not instrument.enabled():
+            yield from zip(items, pool.map(func, items))
+            return
+        for item, (result, events) in zip(items, pool.map(functools.partial(_instrumented, func), items)):
+            instrument.merge(events)
+            yield item, result
+
+
+def add_arguments(parser: argparse.ArgumentParser, work: str = 'Work'):
+    """-j/--jobs, the jobs of map_items; work describes what the workers do"""
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='%s in N worker processes (0 for all cores)' % work)
+
+
+def map_bodies(func: Callable[[Celestial], object], bodies: Iterable[Celestial],
+               jobs: int = 1) -> Iterator[tuple[Celestial, object]]:
+    """map_items over celestial bodies, each sampled or meshed independently"""
+    return map_items(func, bodies, jobs)
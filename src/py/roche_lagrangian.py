@@ -1,9 +1,13 @@
 #!/usr/bin env python3
 import argparse
+import functools
 import os
 import math
+import sys
+import tempfile
 from abc import ABC
 from enum import Enum
+from typing import Iterator, TYPE_CHECKING
 
 #os.environ['ETS_TOOLKIT'] = 'qt4'
 #os.environ['QT_API'] = 'pyqt5'
@@ -12,11 +16,24 @@ from enum import Enum
 #from mayavi import mlab
 
 import numpy as np
-from matplotlib.axes import Axes
-from mpl_toolkits.mplot3d import axes3d
-import matplotlib.pyplot as plt
 
-from solar_constants import *
+import composite as composite_module
+import grid_cache
+import instrument
+import kernels
+import parallel
+from composite import CompositePotential
+from contours import marching_squares, marching_squares_bands, simplify
+from grid_cache import GridCache
+from isosurface import isosurface
+from kernels import roche_gradient_3d, roche_log_log, roche_potential, roche_potential_3d
+from manifest import Manifest, celestial_fields, code_version, digest
+from parallel import map_bodies
+from solar_constants import G, Celestial, Planets, Satellites, Sun
+from transforms import Adjust, Clamp, LogLog, ScaleOffset, Transforms
+
+if TYPE_CHECKING:  # matplotlib is only imported when plotting
+    from matplotlib.axes import Axes
 
 
 def cart2pol(x, y):
@@ -33,16 +50,75 @@ def cart2pol(x, y):
 def pol2cart(phi, rho):
     return rho * np.cos(phi), rho * np.sin(phi)
 
+
+def row_bands(rows: int, size: int) -> Iterator[slice]:
+    """Slices of up to size rows, each sharing its last row with the next so contours and meshes join"""
+    size = max(size, 1)
+    for start in range(0, max(rows - 1, 1), size):
+        yield slice(start, min(start + size + 1, rows))
+
+@functools.cache
+def sampling_version() -> str:
+    """Hash of the code computing sampled grids, so cached grids are keyed to the code that made them"""
+    return code_version('kernels', 'kernels_numba', 'roche_lagrangian', 'composite', 'transforms')
+
 ####################
 
 class Plottable(ABC):
+    dtype = np.dtype(np.float64)  # of the sampled grids
+
     def adjust(self, val: float) -> float:
         raise NotImplementedError
 
     def compute_z_val(self, x_val: float, y_val: float) -> float:
         raise NotImplementedError
 
-    def cartesian_sampling(self, points: int = 1024, radius: float = None, limit: float = 0., mesh: bool = True):
+    def compute_z_grid(self, v_x: np.ndarray, v_y: np.ndarray) -> np.ndarray:
+        """Array-native compute_z_val; subclasses should override with ufunc math"""
+        with instrument.stage('vectorize') as counts:
+            counts['samples'] = np.size(v_x)
+            return np.vectorize(self.compute_z_val)(v_x, v_y)
+
+    def cache_params(self) -> tuple:
+        """Everything besides the sampling arguments that determines compute_z_grid"""
+        raise NotImplementedError
+
+    def cartesian_sampling(self, points: int = 1024, radius: float = None, limit: float = 0., mesh: bool = True,
+                           cache: GridCache = None):
+        if cache is not None:
+            key = cache.key(*self.cache_params(), points, radius, limit, mesh)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            return cache.put(key, self.cartesian_sampling(points, radius, limit, mesh))
+
+        v_x, v_y = self.sampling_grid(points, radius, limit, mesh)
+        with instrument.stage('cartesian_sampling') as counts:
+            v_z = self.compute_z_grid(v_x, v_y)
+            counts['samples'] = v_z.size
+
+        return v_x, v_y, v_z
+
+    def transformed_z_grid(self, v_x: np.ndarray, v_y: np.ndarray, transforms: Transforms) -> np.ndarray:
+        """transforms of compute_z_grid; subclasses fuse what they can into the sampling pass"""
+        return transforms.apply(self.compute_z_grid(v_x, v_y))
+
+    def transformed_sampling(self, transforms: Transforms, points: int = 1024, radius: float = None,
+                             limit: float = 0., cache: GridCache = None):
+        """cartesian_sampling meshgrids with transforms applied to z, in place on a copy of a cached grid"""
+        if cache is not None:
+            v_x, v_y, v_z = self.cartesian_sampling(points, radius, limit, mesh=True, cache=cache)
+            return v_x, v_y, transforms.apply(v_z)
+
+        v_x, v_y = self.sampling_grid(points, radius, limit)
+        with instrument.stage('cartesian_sampling') as counts:
+            v_z = self.transformed_z_grid(v_x, v_y, transforms)
+            counts['samples'] = v_z.size
+        return v_x, v_y, v_z
+
+    def sampling_grid(self, points: int = 1024, radius: float = None, limit: float = 0.,
+                      mesh: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """The (x, y) sample positions of cartesian_sampling"""
         cart = False
         if cart:
             depth = 3. * np.pi / 4.
@@ -51,28 +127,171 @@ class Plottable(ABC):
             if mesh:
                 v_x, v_y = np.meshgrid(v_x, v_y)
         else:
-            points = int(points * np.pi)
-            start = .75
-            end = np.pi / 2.5
-            if radius:
-                start = limit
-                end = radius
-            extra = 2. * np.pi / points + 0.01
-            p_y = np.linspace(0, 2. * np.pi + extra, points, endpoint=False) #[..., np.newaxis]
-            p_x = np.linspace(start, end, points)
+            p_x, p_y = self._polar_axes(points, radius, limit, self.dtype)
             if mesh:
                 p_x, p_y = np.meshgrid(p_x, p_y)
-            v_x, v_y = np.vectorize(pol2cart)(p_y, p_x)
+            v_x, v_y = pol2cart(p_y, p_x)
+        return v_x, v_y
 
-        v_z = np.vectorize(self.compute_z_val)(v_x, v_y)
+    @staticmethod
+    def _polar_axes(points: int, radius: float = None, limit: float = 0.,
+                    dtype: np.dtype = np.float64) -> tuple[np.ndarray, np.ndarray]:
+        points = int(points * np.pi)
+        start = .75
+        end = np.pi / 2.5
+        if radius:
+            start = limit
+            end = radius
+        extra = 2. * np.pi / points + 0.01
+        p_y = np.linspace(0, 2. * np.pi + extra, points, endpoint=False) #[..., np.newaxis]
+        p_x = np.linspace(start, end, points)
+        return p_x.astype(dtype, copy=False), p_y.astype(dtype, copy=False)
+
+    def sampling_tiles(self, points: int = 1024, radius: float = None, limit: float = 0.,
+                       rows: int = 256) -> Iterator[tuple[slice, np.ndarray, np.ndarray, np.ndarray]]:
+        """The meshgrid of cartesian_sampling computed in bands of rows (see row_bands)"""
+        p_x, p_y = self._polar_axes(points, radius, limit, self.dtype)
+        for band in row_bands(len(p_y), rows):
+            v_x, v_y = pol2cart(*np.meshgrid(p_y[band], p_x, indexing='ij'))
+            yield band, v_x, v_y, self.compute_z_grid(v_x, v_y)
+
+    def sample_to_memmap(self, path: str, points: int = 1024, radius: float = None, limit: float = 0.,
+                         rows: int = 256) -> np.memmap:
+        """Stream sampling tiles into a (3, rows, columns) .npy file, holding one tile in memory at a time"""
+        p_x, p_y = self._polar_axes(points, radius, limit)
+        grid = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=(3, len(p_y), len(p_x)))
+        for band, v_x, v_y, v_z in self.sampling_tiles(points, radius, limit, rows):
+            grid[0, band], grid[1, band], grid[2, band] = v_x, v_y, v_z
+        grid.flush()
+        return grid
+
+    def feature_points(self) -> list[tuple[float, float]]:
+        """Unit-distance (x, y) points that adaptive_sampling refines around"""
+        return []
+
+    def adaptive_sampling(self, points: int = 1024, radius: float = None, limit: float = 0., z_limit: float = None,
+                          pilot: int = 64, cache: GridCache = None):
+        """Polar meshgrid like cartesian_sampling, with samples concentrated where z changes fastest
+
+        A coarse pilot grid gives the gradient along each polar axis; feature_points add
+        further density. Samples are placed by inverting the cumulative density, so the
+        grid stays structured. z_limit clamps z as the caller will, so clipped regions
+        are not refined.
+        """
+        if cache is not None:
+            key = cache.key(*self.cache_params(), 'adaptive', points, radius, limit, z_limit, pilot)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            return cache.put(key, self.adaptive_sampling(points, radius, limit, z_limit, pilot))
+
+        points = int(points * np.pi)
+        start = .75
+        end = np.pi / 2.5
+        if radius:
+            start = limit
+            end = radius
+        rho = np.linspace(start, end, pilot)
+        phi = np.linspace(0, 2. * np.pi, pilot, endpoint=False)
+        p_rho, p_phi = np.meshgrid(rho, phi)
+        z = self.compute_z_grid(*pol2cart(p_phi, p_rho))
+        if z_limit is not None:
+            z = np.minimum(z, z_limit)
+        z = np.where(np.isfinite(z), z, np.nan)
+        d_phi, d_rho = np.gradient(z, phi, rho)
+        rho_density = np.nanmean(np.abs(d_rho), axis=0)
+        phi_density = np.nanmean(np.abs(d_phi) / p_rho, axis=1)
+
+        features = np.array(self.feature_points(), dtype=float).reshape(-1, 2)
+        f_phi, f_rho = cart2pol(features[:, 0], features[:, 1])
+        rho_width = 4. * (end - start) / pilot
+        phi_width = 4. * 2. * np.pi / pilot
+        rho_bumps = np.exp(-((rho[:, np.newaxis] - f_rho) / rho_width) ** 2).sum(axis=1)
+        phi_offset = np.angle(np.exp(1j * (phi[:, np.newaxis] - f_phi)))  # wrapped to [-pi, pi]
+        phi_bumps = np.exp(-(phi_offset / phi_width) ** 2).sum(axis=1)
+
+        p_x = _inverse_density(rho, _density(rho_density, rho_bumps), points)
+        # runs from 0 to 2 pi inclusive, closing the seam
+        p_y = _inverse_density(np.append(phi, 2. * np.pi), _density(phi_density, phi_bumps, wrap=True), points)
+        p_x, p_y = np.meshgrid(p_x.astype(self.dtype), p_y.astype(self.dtype))
+        v_x, v_y = pol2cart(p_y, p_x)
+        with instrument.stage('adaptive_sampling') as counts:
+            counts['samples'] = v_x.size + z.size
+            return v_x, v_y, self.compute_z_grid(v_x, v_y)
+
+    def plot(self, ax: 'Axes', points: int = 1024, with_text: bool = False, three_d: bool = False):
+        raise NotImplementedError
 
-        return v_x, v_y, v_z
 
-    def plot(self, ax: Axes, points: int = 1024, with_text: bool = False, three_d: bool = False):
-        raise NotImplementedError
+def _density(gradient: np.ndarray, bumps: np.ndarray, wrap: bool = False, ceiling: float = 8.) -> np.ndarray:
+    """Sample density along one axis: a uniform floor plus gradient and feature terms, each averaging one"""
+    gradient = np.sqrt(np.nan_to_num(gradient))
+    density = 1. + gradient / (gradient.mean() or 1.) + bumps / (bumps.mean() or 1.)
+    density = np.minimum(density, ceiling * density.mean())
+    if wrap:
+        density = np.append(density, density[0])
+    return density
+
+
+def _inverse_density(axis: np.ndarray, density: np.ndarray, count: int) -> np.ndarray:
+    cdf = np.concatenate(([0.], np.cumsum((density[1:] + density[:-1]) / 2. * np.diff(axis))))
+    return np.interp(np.linspace(0., cdf[-1], count), cdf, axis)
 
 ####################
 
+def _roche_derivative(x1, x2, x):
+    return +x2 / np.power(x - x1, 2) * np.sign(x - x1) - \
+        x1 / np.power(x - x2, 2) * np.sign(x - x2) - x
+
+
+def _roche_second_derivative(x1, x2, x):
+    return -2. * x2 / np.power(np.abs(x - x1), 3) + 2. * x1 / np.power(np.abs(x - x2), 3) - 1.
+
+
+def _solve_collinear(x1, x2, guess, low, high, tolerance: float = 1e-13, iterations: int = 100):
+    """Safeguarded Newton iteration for roots of the on-axis derivative, elementwise over arrays
+
+    Between the masses and beyond them the derivative falls monotonically, so its sign
+    tells which side of x the root is on; steps leaving the bracket fall back to bisection.
+    """
+    x = np.array(guess, dtype=float)
+    low, high = np.broadcast_arrays(np.array(low, dtype=float), np.array(high, dtype=float))
+    low, high = low.copy(), high.copy()
+    for _ in range(iterations):
+        f = _roche_derivative(x1, x2, x)
+        above = f > 0.
+        low = np.where(above, x, low)
+        high = np.where(above, high, x)
+        step = x - f / _roche_second_derivative(x1, x2, x)
+        step = np.where((step >= low) & (step <= high), step, 0.5 * (low + high))
+        converged = np.abs(step - x) <= tolerance * np.maximum(1., np.abs(x))
+        x = step
+        if np.all(converged):
+            break
+    return x
+
+
+def lagrange_points(q) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """x, y and potential of L1-L5 for mass ratios q >= 1, each shaped q.shape + (5,)"""
+    q = np.asarray(q, dtype=float)
+    x1 = -1 / (q + 1)
+    x2 = q / (q + 1)
+    # Hill sphere and L3 series for the initial guesses
+    mu = -x1
+    hill = np.cbrt(mu / 3.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        l1 = _solve_collinear(x1, x2, x2 - hill * (1. - hill / 3.), x1, x2)
+        l2 = _solve_collinear(x1, x2, x2 + hill * (1. + hill / 3.), x2, 2.)
+        l3 = _solve_collinear(x1, x2, -1. - 5. * mu / 12., -2., x1)
+    l4_x = 0.5 * (x1 + x2)
+    l4_y = np.sqrt(3) / 2 * np.abs(x1 - x2)
+
+    xs = np.stack((l1, l2, l3, l4_x, l4_x), axis=-1)
+    ys = np.stack((np.zeros_like(q), np.zeros_like(q), np.zeros_like(q), l4_y, -l4_y), axis=-1)
+    phis = roche_potential(x1[..., np.newaxis], x2[..., np.newaxis], xs, ys)
+    return xs, ys, phis
+
+
 class Lagrangian:
     class Point(str, Enum):
         L1 = 'L1'
@@ -83,136 +302,260 @@ class Lagrangian:
 
     def __init__(self, m_1: float, m_2: float):
         # normally q < 1, but that does not converge
-        q = m_1 / m_2 if m_1 > m_2 else m_2 / m_1
+        self.q = m_1 / m_2 if m_1 > m_2 else m_2 / m_1
         # normally xes * (m_1 * m_2), but reduces numerical range to indistinguishable
         # also x1 negative, thus centered on zero, for computability
-        self.x1 = -1 / (q + 1)
-        self.x2 = q / (q + 1)
+        self.x1 = -1 / (self.q + 1)
+        self.x2 = self.q / (self.q + 1)
+
+    @functools.cached_property
+    def _solution(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return lagrange_points(self.q)
 
+    def points(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """x, y and potential of all five points, in Point order, solved once per instance"""
+        return self._solution
 
     def coords(self, which: Point):
         """Lagrangian point coordinates in unit distance"""
-        def _find(x_low, x_up):
-            # newtonian solver
-            xi = 0
-            while abs(x_low - x_up) > 1e-10:
-                xi = 0.5 * (x_low + x_up)
-                if self.roche_derivative(xi) > 0.:
-                    x_low = xi
-                else:
-                    x_up = xi
-            return xi
-        if which == self.Point.L1:
-            return _find(self.x1 * 0.99, self.x2 * 0.99), 0.
-        if which == self.Point.L2:
-            return _find(self.x2 * 1.01, 2), 0.
-        if which == self.Point.L3:
-            return _find(-2, self.x1 * 1.01), 0.
-        if which == self.Point.L4:
-            return 0.5 * (self.x1 + self.x2), np.sqrt(3) / 2 * abs(self.x1 - self.x2)
-        if which == self.Point.L5:
-            return 0.5 * (self.x1 + self.x2), -(np.sqrt(3) / 2 * abs(self.x1 - self.x2))
+        xs, ys, _ = self._solution
+        index = list(self.Point).index(which)
+        return float(xs[index]), float(ys[index])
+
+    def potential(self, which: Point) -> float:
+        _, _, phis = self._solution
+        return float(phis[list(self.Point).index(which)])
 
     def roche_potential(self, x: float, y: float):
-        return (-self.x2 / np.sqrt(np.power(x - self.x1, 2) + np.power(y, 2))) \
-            + (self.x1 / np.sqrt(np.power(x - self.x2, 2) + np.power(y, 2))) \
-            - 0.5 * (np.power(x, 2) + np.power(y, 2))
+        return roche_potential(self.x1, self.x2, x, y)
 
     def roche_derivative(self, x: float) -> float:
-        return +self.x2 / np.power(x - self.x1, 2) * np.sign(x - self.x1) - \
-            self.x1 / np.power(x - self.x2, 2) * np.sign(x - self.x2) - x
+        return _roche_derivative(self.x1, self.x2, x)
 
 
 class RocheLagrangian(Plottable):
-    def __init__(self, m_1: float, m_2: float, dist: float):
+    def __init__(self, m_1: float, m_2: float, dist: float, dtype: np.dtype = np.float64,
+                 origin: tuple[float, float] = (0., 0.)):
+        """dtype float32 samples and transforms grids at half the memory, in place; plot draws the
+        barycenter at origin (km)"""
         super().__init__()
         self.lagrange = Lagrangian(m_1, m_2)
         self.dist = dist
+        self.dtype = np.dtype(dtype)
+        self.origin = origin
 
         self.barycenter = self.adjust(m_2 / (m_1 + m_2))
         self.M1 = -self.barycenter, 0
         self.M2 = self.adjust(1) - self.barycenter, 0
 
-        self.L1 = tuple(map(self.adjust, self.lagrange.coords(Lagrangian.Point.L1)))
-        self.L2 = tuple(map(self.adjust, self.lagrange.coords(Lagrangian.Point.L2)))
-        self.L3 = tuple(map(self.adjust, self.lagrange.coords(Lagrangian.Point.L3)))
-        self.L4 = tuple(map(self.adjust, self.lagrange.coords(Lagrangian.Point.L4)))
-        self.L5 = tuple(map(self.adjust, self.lagrange.coords(Lagrangian.Point.L5)))
-
-        self.phi_L1 = self.lagrange.roche_potential(*self.lagrange.coords(Lagrangian.Point.L1))
-        self.phi_L2 = self.lagrange.roche_potential(*self.lagrange.coords(Lagrangian.Point.L2))
-        self.phi_L3 = self.lagrange.roche_potential(*self.lagrange.coords(Lagrangian.Point.L3))
-        self.phi_L4_5 = self.lagrange.roche_potential(*self.lagrange.coords(Lagrangian.Point.L4))
+        xs, ys, phis = self.lagrange.points()
+        self.L1, self.L2, self.L3, self.L4, self.L5 = [(self.adjust(float(x)), self.adjust(float(y)))
+                                                       for x, y in zip(xs, ys)]
+        self.phi_L1, self.phi_L2, self.phi_L3, self.phi_L4_5 = [float(phi) for phi in phis[:4]]
 
     def adjust(self, a: float) -> float:
-        a *= self.dist
-        return a
+        return a * self.dist
+
+    def _placed(self, point: tuple[float, float]) -> tuple[float, float]:
+        return point[0] + self.origin[0], point[1] + self.origin[1]
 
     @staticmethod
     def alter_raw_z(z_val: float) -> float:
-        return math.log10(math.log10(math.fabs(z_val)))
+        return np.log10(np.log10(np.fabs(z_val)))
 
     def compute_z_val(self, x_val: float, y_val: float) -> float:
         z_val = self.lagrange.roche_potential(x_val, y_val)
         return self.alter_raw_z(z_val)
 
-    def plot(self, ax: Axes, points: int = 1024, with_text: bool = True, three_d: bool = False, fill: bool = True):
-        if three_d:
-            points //= 8
+    def cache_params(self) -> tuple:
+        return type(self).__name__, self.lagrange.x1, self.lagrange.x2, self.dtype.name, sampling_version()
 
-        scale = 1
-        limit = 0.
-        radius = None
+    def feature_points(self) -> list[tuple[float, float]]:
+        xs, ys, _ = self.lagrange.points()
+        return list(zip(xs.tolist(), ys.tolist())) + [(self.lagrange.x2, 0.)]
+
+    def compute_z_grid(self, v_x: np.ndarray, v_y: np.ndarray) -> np.ndarray:
+        return roche_log_log(self.lagrange.x1, self.lagrange.x2, v_x, v_y)
+
+    def transformed_z_grid(self, v_x: np.ndarray, v_y: np.ndarray, transforms: Transforms) -> np.ndarray:
+        # a leading clamp and scale/offset run inside the kernel's pass
+        limit, scale, offset, rest = transforms.fusable()
+        return rest.apply(roche_log_log(self.lagrange.x1, self.lagrange.x2, v_x, v_y, limit, scale, offset))
+
+    @staticmethod
+    def _plot_params(three_d: bool) -> tuple[float, float, float]:
         if three_d:
-            scale = -1.5
-            limit = .5
-            radius = 1.725
-        v_x, v_y, v_z = self.cartesian_sampling(points, radius=radius, limit=limit, mesh=False)
-        v_x = np.vectorize(self.adjust)(v_x)
-        v_y = np.vectorize(self.adjust)(v_y)
-        v_z = np.vectorize(lambda z: self.adjust(scale * (z if z < limit else limit) - .725))(v_z)
+            return -1.5, .5, 1.725  # scale, limit, radius
+        return 1, 0., None
 
-        print('Max', np.max(v_z))
-        print('Min', np.min(v_z))
-        print('Diameter', np.sqrt((np.min(v_x) - np.max(v_x))**2 + (np.min(v_y) - np.max(v_y))**2))
-        print('X',v_x.shape)
-        print('Y',v_y.shape)
-        print('Z',v_z.shape)
+    def plot_transforms(self, three_d: bool) -> Transforms:
+        """Raw z to the z plot draws"""
+        scale, limit, _ = self._plot_params(three_d)
+        return Transforms(Clamp(limit), ScaleOffset(scale, -.725), Adjust(self.dist))
+
+    def _plot_z(self, z: np.ndarray, three_d: bool) -> np.ndarray:
+        return self.plot_transforms(three_d).apply(z, copy=True)
+
+    def plot_samples(self, points: int = 1024, three_d: bool = False, cache: GridCache = None,
+                     tile_rows: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Raw (x, y, z) grids drawn by plot, separate so they can be computed in a worker
+
+        With tile_rows the grid is streamed in bands into the cache, or without one into a
+        temporary file, and returned memory-mapped, so it never has to fit in memory.
+        """
+        if three_d:
+            points //= 8
+        _, limit, radius = self._plot_params(three_d)
+        if tile_rows and cache is None:
+            handle, path = tempfile.mkstemp(suffix='.npy')
+            os.close(handle)
+            try:
+                return tuple(self.sample_to_memmap(path, points, radius, limit, tile_rows))
+            finally:
+                os.remove(path)  # the mapping outlives the name
+        if tile_rows:
+            key = cache.key(*self.cache_params(), points, radius, limit, True)
+            p_x, p_y = self._polar_axes(points, radius, limit)
+            return cache.get(key) or cache.put_tiles(key, (3, len(p_y), len(p_x)),
+                                                     self.sampling_tiles(points, radius, limit, tile_rows), self.dtype)
+        return self.cartesian_sampling(points, radius=radius, limit=limit, mesh=True, cache=cache)
+
+    def contour_levels(self) -> dict[str, float]:
+        """Raw z of the L1, L2, L3 and L4/L5 equipotentials"""
+        return {'L1': self.alter_raw_z(self.phi_L1),
+                'L2': self.alter_raw_z(self.phi_L2),
+                'L3': self.alter_raw_z(self.phi_L3),
+                'L4_5': self.alter_raw_z(self.phi_L4_5*1.0001)}
+
+    def equipotentials(self, points: int = 500, tolerance: float = 0., samples: tuple = None,
+                       cache: GridCache = None, tile_rows: int = None) -> dict[str, list[np.ndarray]]:
+        """(n, 2) polylines in km of each contour_levels() equipotential, traced without matplotlib
+
+        A positive tolerance (km) simplifies them with Douglas-Peucker. With tile_rows the
+        grid is sampled and traced in bands of rows (see plot_samples and marching_squares_bands).
+        """
+        if samples is None:
+            samples = self.plot_samples(points, cache=cache, tile_rows=tile_rows)
+        raw_x, raw_y, raw_z = samples
+        lines = {}
+        for name, level in self.contour_levels().items():
+            if tile_rows:
+                traced = marching_squares_bands(raw_x, raw_y, raw_z, level, tile_rows)
+            else:
+                traced = marching_squares(raw_x, raw_y, raw_z, level)
+            lines[name] = [self.adjust(line) + self.origin for line in traced]
+            if tolerance > 0:
+                lines[name] = [simplify(line, tolerance) for line in lines[name]]
+        return lines
+
+    def lobes(self, points: int = 96, slab: int = 16) -> dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Indexed (points, normals, indices) of the L1 and L2 equipotential surfaces about m_2, in unit distance
+
+        Sampled with points per side between L1 and L2 and a Hill radius either side of the
+        orbital plane, which holds both surfaces but none of the region beyond L1 and L2 that
+        lies below those potentials too. The L1 surface is the Roche lobe of m_2; the L2
+        surface continues through L1 towards m_1 and is capped there.
+        """
+        x1, x2 = self.lagrange.x1, self.lagrange.x2
+        xs, _, _ = self.lagrange.points()
+        hill = np.cbrt(-x1 / 3.)
+        axis = np.linspace(-hill, hill, points)
+        field = functools.partial(roche_potential_3d, x1, x2)
+        gradient = functools.partial(roche_gradient_3d, x1, x2)
+        with np.errstate(divide='ignore'):
+            return {name: isosurface(field, gradient, np.linspace(xs[0], xs[1], points), axis, axis, level, slab,
+                                     closed=True)
+                    for name, level in (('L1', self.phi_L1), ('L2', self.phi_L2))}
+
+    def plot(self, ax: 'Axes', points: int = 1024, with_text: bool = True, three_d: bool = False, fill: bool = True,
+             samples: tuple[np.ndarray, np.ndarray, np.ndarray] = None, tile_rows: int = None, verbose: bool = True,
+             z_range: tuple[float, float] = None):
+        """Draw the potential; with tile_rows, samples are adjusted and drawn one band of rows at a time
+
+        z_range overrides the plotted z extent that sets the fill levels, so partial grids
+        (e.g. cropped to a map tile) share the colour scale of the whole grid.
+        """
+        if samples is None:
+            samples = self.plot_samples(points, three_d, tile_rows=tile_rows)
+        raw_x, raw_y, raw_z = samples
+        bands = list(row_bands(len(raw_z), tile_rows or len(raw_z)))
+
+        z_min, z_max = np.inf, -np.inf
+        x_min, x_max, y_min, y_max = np.inf, -np.inf, np.inf, -np.inf
+        for band in bands:
+            v_z = self._plot_z(raw_z[band], three_d)
+            z_min, z_max = min(z_min, np.min(v_z)), max(z_max, np.max(v_z))
+            x_min, x_max = min(x_min, np.min(raw_x[band])), max(x_max, np.max(raw_x[band]))
+            y_min, y_max = min(y_min, np.min(raw_y[band])), max(y_max, np.max(raw_y[band]))
+        if verbose:
+            print('Max', z_max)
+            print('Min', z_min)
+            print('Diameter', self.adjust(np.sqrt((x_min - x_max)**2 + (y_min - y_max)**2)))
+            print('X', raw_x.shape)
+            print('Y', raw_y.shape)
+            print('Z', raw_z.shape)
 
         colors = ['w', 'r', 'b', 'g', 'c']
-        lines = sorted([(np.min(v_z), colors[0]),
-                        (self.alter_raw_z(self.phi_L1), colors[1]),
-                        (self.alter_raw_z(self.phi_L2), colors[2]),
-                        (self.alter_raw_z(self.phi_L3), colors[3]),
-                        (self.alter_raw_z(self.phi_L4_5*1.0001), colors[4])], key=lambda x: x[0])
+        if z_range is not None:
+            z_min, z_max = z_range
+        lines = sorted([(z_min, colors[0])] +
+                       [(self._plot_z(level, three_d), color)
+                        for level, color in zip(self.contour_levels().values(), colors[1:])],
+                       key=lambda x: x[0])
         levels = [x[0] for x in lines]
         #levels = [np.min(v_z), phi_l1, phi_l2, phi_l3, phi_l4, np.max(v_z)*.99]
 
         color_seq = 'gist_gray' #'binary'
         pt_color = 'k' #'k' 'w'
 
-        # FIXME displace on x-axis to center on the sun, not barycenter
-
-        if three_d:
-            ax.plot_surface(v_x, v_y, v_z, cmap="viridis_r", rstride=1, cstride=1, alpha=0.5)
-            ax.plot_surface(v_x, v_y, -v_z, cmap="viridis", rstride=1, cstride=1, alpha=0.5)
-        else:
-            if fill:
-                ax.contourf(v_x, v_y, v_z, cmap=color_seq, antialiased=True, alpha=0.5)
-            ax.contour(v_x, v_y, v_z, levels, colors=colors, linestyles="solid", linewidths=1, antialiased=True, alpha=0.75)
-
+        # the default contourf levels, fixed up front so every band shares them
+        from matplotlib.ticker import MaxNLocator
+        fill_levels = MaxNLocator(8).tick_values(z_min, z_max)
+
+        for band in bands:
+            v_x = self.adjust(raw_x[band]) + self.origin[0]
+            v_y = self.adjust(raw_y[band]) + self.origin[1]
+            v_z = self._plot_z(raw_z[band], three_d)
+            if three_d:
+                ax.plot_surface(v_x, v_y, v_z, cmap="viridis_r", rstride=1, cstride=1, alpha=0.5)
+                ax.plot_surface(v_x, v_y, -v_z, cmap="viridis", rstride=1, cstride=1, alpha=0.5)
+            else:
+                if fill:
+                    ax.contourf(v_x, v_y, v_z, fill_levels, cmap=color_seq, antialiased=True, alpha=0.5)
+                ax.contour(v_x, v_y, v_z, levels, colors=colors, linestyles="solid", linewidths=1, antialiased=True, alpha=0.75)
+
+        if not three_d:
             if with_text:
-                ax.text(*self.L1, 'L1', color=pt_color, horizontalalignment='center', verticalalignment='center')
-                ax.text(*self.L2, 'L2', color=pt_color, horizontalalignment='center', verticalalignment='center')
-                ax.text(*self.L3, 'L3', color=pt_color, horizontalalignment='center', verticalalignment='center')
-                ax.text(*self.L4, 'L4', color=pt_color, horizontalalignment='center', verticalalignment='center')
-                ax.text(*self.L5, 'L5', color=pt_color, horizontalalignment='center', verticalalignment='center')
-                ax.plot(*self.M1, "b.", label="$m_1$")
-                ax.plot(*self.M2, "w,", label="$m_2$")
-                ax.plot(0,0, pt_color + '+')
+                for name in ('L1', 'L2', 'L3', 'L4', 'L5'):
+                    ax.text(*self._placed(getattr(self, name)), name, color=pt_color, horizontalalignment='center',
+                            verticalalignment='center')
+                ax.plot(*self._placed(self.M1), "b.", label="$m_1$")
+                ax.plot(*self._placed(self.M2), "w,", label="$m_2$")
+                ax.plot(*self.origin, pt_color + '+')
         ax.set_axis_off()
         ax.set_aspect("equal")
 
+class CompositeRoche(RocheLagrangian):
+    """RocheLagrangian of one body's subsystem of a CompositePotential
+
+    Sampled about the subsystem's barycenter as usual, but evaluated with every body in
+    reach, and drawn where the hierarchy places the barycenter.
+    """
+
+    def __init__(self, composite: CompositePotential, body: Celestial, dtype: np.dtype = np.float64):
+        super().__init__(body.orbits.mass, body.mass, body.semimajor, dtype, composite.subsystems[body.name].center)
+        self.composite = composite
+        self.body = body.name
+
+    def cache_params(self) -> tuple:
+        return super().cache_params() + (self.body,) + self.composite.key()
+
+    def compute_z_grid(self, v_x: np.ndarray, v_y: np.ndarray) -> np.ndarray:
+        # in double precision, as the km offsets from the root dwarf a satellite's region
+        x = self.adjust(np.asarray(v_x, dtype=float)) + self.origin[0]
+        y = self.adjust(np.asarray(v_y, dtype=float)) + self.origin[1]
+        return LogLog()(self.composite.evaluate(x, y, self.body)).astype(self.dtype, copy=False)
+
 ####################
 
 def grav_potential(mass: float, radius: float, x: float, y: float, limit: float = 1e-9) -> float:
@@ -222,6 +565,15 @@ def grav_potential(mass: float, radius: float, x: float, y: float, limit: float
     return -G * mass / dist ** 2
 
 
+def grav_potential_grid(mass: float, radius: float, x: np.ndarray, y: np.ndarray, limit: float = 1e-9) -> np.ndarray:
+    dist = np.hypot(x, y)
+    inside = dist == 0
+    if radius is not None:
+        inside |= dist <= radius
+    with np.errstate(divide='ignore'):
+        return np.where(inside, limit, -G * mass / dist ** 2)
+
+
 class GravitationalPotential(Plottable):
     def __init__(self, mass: float, radius: float = None):
         super().__init__()
@@ -235,16 +587,22 @@ class GravitationalPotential(Plottable):
     def compute_z_val(self, x_val: float, y_val: float) -> float:
         return grav_potential(self.mass, self.radius, self.adjust(x_val), self.adjust(y_val))
 
-    def plot(self, ax: Axes, points: int = 1024, radius: float = None, with_text: bool = False, three_d: bool = False):
+    def cache_params(self) -> tuple:
+        return type(self).__name__, self.mass, self.radius, self.dist, sampling_version()
+
+    def compute_z_grid(self, v_x: np.ndarray, v_y: np.ndarray) -> np.ndarray:
+        return grav_potential_grid(self.mass, self.radius, self.adjust(v_x), self.adjust(v_y))
+
+    def plot(self, ax: 'Axes', points: int = 1024, radius: float = None, with_text: bool = False, three_d: bool = False):
         if three_d:
             points //= 8
         v_x, v_y, v_z = self.cartesian_sampling(points, radius=radius)
-        v_x = np.vectorize(self.adjust)(v_x)
-        v_y = np.vectorize(self.adjust)(v_y)
+        v_x = self.adjust(v_x)
+        v_y = self.adjust(v_y)
         scale = 1
         if three_d:
             scale = -10
-        v_z = np.vectorize(lambda z: self.adjust(scale * math.log10(math.fabs(math.log10(math.fabs(z))))))(v_z)
+        v_z = self.adjust(scale * np.log10(np.fabs(np.log10(np.fabs(v_z)))))
 
         print('Max', np.max(v_z))
         print('Min', np.min(v_z))
@@ -261,14 +619,56 @@ class GravitationalPotential(Plottable):
 
 ####################
 
-def plot_solar_system(directory: str = os.getcwd(), display: bool = False):
+def planet_system(planet: Celestial) -> RocheLagrangian:
+    """A planet and its primary, drawn about the primary rather than the barycenter"""
+    barycenter = planet.mass / (planet.orbits.mass + planet.mass) * planet.semimajor
+    return RocheLagrangian(planet.orbits.mass, planet.mass, planet.semimajor, origin=(barycenter, 0.))
+
+
+def _sample_planet(planet: Celestial, points: int, three_d: bool, cache: GridCache = None,
+                   tile_rows: int = None,
+                   composite: CompositePotential = None) -> tuple[RocheLagrangian, tuple | None]:
+    # always in double precision: L1 and L2 differ by a few float32 ulps or less, so their
+    # contours would trace noise
+    if composite is not None:
+        rl = CompositeRoche(composite, planet)
+    else:
+        rl = planet_system(planet)
+    with instrument.stage('sample', body=planet.name):
+        samples = rl.plot_samples(points, three_d, cache=cache, tile_rows=tile_rows)
+    # cached samples are memory-mapped again in the parent rather than copied through the pool
+    return rl, None if cache is not None else samples
+
+
+def plot_solar_system(directory: str = os.getcwd(), display: bool = False, jobs: int = 1,
+                      cache: GridCache = None, force: bool = False, points: int = 500, tile_rows: int = None,
+                      bodies: list[Celestial] = None, dpi: int = None, composite: bool = False):
+    """With composite, the satellites of bodies are drawn too, and every potential sums the
+    gravity of all bodies in reach with each placed along +x from the Sun (see CompositePotential)"""
+    bodies = Planets if bodies is None else bodies
+    if composite:
+        bodies = bodies + [satellite for satellite in Satellites if satellite.orbits in bodies]
     size = [100, 100]
     res = 655
     if display:
         size = [5, 5]
         res = 300
+    res = dpi or res
 
     three_dim = False
+    filepath = os.path.join(directory, "solar_system.svg")
+    manifest = Manifest(directory)
+    # banded drawing emits separate artists per band, so tile_rows changes the SVG
+    inputs = digest([celestial_fields(planet) for planet in bodies], points, three_dim, size, res,
+                    composite, tile_rows, code_version(sys.modules[__name__], kernels, 'kernels_numba', composite_module,
+                                                      'transforms'))
+    if not display and not force and manifest.up_to_date(filepath, inputs):
+        print("%s is up to date" % filepath)
+        return
+
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import axes3d  # registers the 3d projection
+
     # max size is 2^16 (65536) in each direction
     fig = plt.figure(figsize=size, dpi=res, tight_layout=True)
     if three_dim:
@@ -280,19 +680,17 @@ def plot_solar_system(directory: str = os.getcwd(), display: bool = False):
     gp = GravitationalPotential(Sun.mass, Sun.radius)
     #gp.plot(ax, points=100, radius=180, three_d=three_dim)
 
-    for planet in Planets:
-        rl = RocheLagrangian(planet.orbits.mass, planet.mass, planet.semimajor)
-        print('%s:' % planet.name)
-        print('  %s: (%f, %f)' % (planet.orbits.name, *rl.M1))
-        print('  %s: (%f, %f)' % (planet.name, *rl.M2))
-        print('  L1: (%f, %f) phi=%f' % (*rl.L1, rl.phi_L1))
-        print('  L2: (%f, %f) phi=%f' % (*rl.L2, rl.phi_L2))
-        print('  L3: (%f, %f) phi=%f' % (*rl.L3, rl.phi_L3))
-        print('  L4: (%f, %f) phi=%f' % (*rl.L4, rl.phi_L4_5))
-        print('  L5: (%f, %f) phi=%f' % (*rl.L5, rl.phi_L4_5))
-        rl.plot(ax, points=500, with_text=display, three_d=three_dim, fill=True)
-
-    # for satellite in Satellites  # FIXME displace on x-axis
+    from system_table import system_table, print_system  # deferred: system_table imports this module
+    sample = functools.partial(_sample_planet, points=points, three_d=three_dim, cache=cache, tile_rows=tile_rows,
+                               composite=CompositePotential(bodies) if composite else None)
+    for row in system_table(bodies):
+        print_system(row)
+    for planet, (rl, samples) in map_bodies(sample, bodies, jobs):
+        with instrument.stage('draw', body=planet.name) as counts:
+            if samples is None:
+                samples = rl.plot_samples(points, three_dim, cache=cache, tile_rows=tile_rows)
+            rl.plot(ax, with_text=display, three_d=three_dim, fill=True, samples=samples, tile_rows=tile_rows)
+            counts['samples'] = samples[2].size
 
     fig.tight_layout()
     #plt.gca().set_position([0, 0, 1, 1])
@@ -304,17 +702,37 @@ def plot_solar_system(directory: str = os.getcwd(), display: bool = False):
             plt.close()
             print()
     else:
-        filepath = os.path.join(directory, "solar_system.svg")
-        plt.savefig(filepath, bbox_inches='tight', pad_inches=0)
+        with instrument.stage('savefig') as counts:
+            plt.savefig(filepath, bbox_inches='tight', pad_inches=0)
+            counts['bytes'] = os.path.getsize(filepath)
+        manifest.record(filepath, inputs)
         print("Saved to %s" % filepath)
 
 
-if __name__ == "__main__":
+def main(argv: list[str] = None, prog: str = None):
     parser = argparse.ArgumentParser(
-        prog=os.path.basename(__file__),
+        prog=prog or os.path.basename(__file__),
         description='Plot solar system Lagrangians and Roche potentials')
     parser.add_argument('-C', '--directory', type=str, default=os.getcwd(), help='Directory to save plot')
     parser.add_argument('--display', action='store_true', help='Display plot (does not save)')
-    args = parser.parse_args()
+    parallel.add_arguments(parser, 'Sample bodies')
+    grid_cache.add_arguments(parser)
+    parser.add_argument('--force', action='store_true', help='Replot even if the inputs are unchanged')
+    parser.add_argument('--points', type=int, default=500, help='Sampling density of each planet')
+    parser.add_argument('--tile-rows', type=int, default=None,
+                        help='Sample and draw in bands of N rows, streaming grids through the cache')
+    parser.add_argument('--dpi', type=int, default=None, help='Override the resolution of the figure')
+    parser.add_argument('--composite', action='store_true',
+                        help='Sum the potentials of all bodies, drawing satellites about their planets')
+    instrument.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.tile_rows and args.no_cache:
+        parser.error('--tile-rows streams grids through the cache, so cannot be used with --no-cache')
+
+    with instrument.session_from(args):
+        plot_solar_system(args.directory, args.display, args.jobs, grid_cache.from_arguments(args), args.force,
+                          args.points, args.tile_rows, dpi=args.dpi, composite=args.composite)
+
 
-    plot_solar_system(args.directory, args.display)
+if __name__ == "__main__":
+    main()
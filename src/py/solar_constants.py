@@ -1,32 +1,52 @@
+import math
 from typing import Union
 
 G = 6.6743015e-11
 
 class Celestial:
-    def __init__(self, name: str, mass: float, radius: float, semimajor: float, orbits: Union['Celestial', None]):
+    def __init__(self, name: str, mass: float, radius: float, semimajor: float, orbits: Union['Celestial', None],
+                 eccentricity: float = 0.):
         self.name = name
         self.mass = mass  # kg
         self.radius = radius  # km
         self.semimajor = semimajor  # km to body it orbits
         self.orbits = orbits
+        self.eccentricity = eccentricity
 
     @property
     def parent(self):
         return self.orbits.name
 
+    @property
+    def period(self) -> float:
+        """Keplerian orbital period in seconds"""
+        return 2 * math.pi * math.sqrt((self.semimajor * 1e3) ** 3 / (G * (self.orbits.mass + self.mass)))
+
+
+def with_primaries(bodies: list['Celestial']) -> list['Celestial']:
+    """bodies and everything they orbit, each after its primary"""
+    ordered = []
+    for body in bodies:
+        chain = []
+        while body is not None and body not in ordered and body not in chain:
+            chain.append(body)
+            body = body.orbits
+        ordered += chain[::-1]
+    return ordered
+
 
 Sun = Celestial("Sun", 1.9884e30, 695700., 0., None)
 
-Mercury = Celestial("Mercury", 0.33010e24, 2439.7, 57.909e6, Sun)
-Venus = Celestial("Venus", 4.8673e24, 6051.8, 108.210e6, Sun)
-Earth = Celestial("Earth", 5.974e24, 6371., 149.59887e6, Sun)
-Mars = Celestial("Mars", 0.64169e24, 3389.5, 227.956e6, Sun)
-Jupiter = Celestial("Jupiter", 1898.13e24, 71492., 778.479e6, Sun)
-Saturn = Celestial("Saturn", 568.32e24, 58232., 1432.041e6, Sun)
-Uranus = Celestial("Uranus", 86.811e24, 25362., 2867.043e6, Sun)
-Neptune = Celestial("Neptune", 102.409e24, 24622., 4514.953e6, Sun)
-Pluto = Celestial("Pluto", 0.01303e24, 1188., 5869.656e6, Sun)
+Mercury = Celestial("Mercury", 0.33010e24, 2439.7, 57.909e6, Sun, 0.2056)
+Venus = Celestial("Venus", 4.8673e24, 6051.8, 108.210e6, Sun, 0.0068)
+Earth = Celestial("Earth", 5.974e24, 6371., 149.59887e6, Sun, 0.0167)
+Mars = Celestial("Mars", 0.64169e24, 3389.5, 227.956e6, Sun, 0.0935)
+Jupiter = Celestial("Jupiter", 1898.13e24, 71492., 778.479e6, Sun, 0.0487)
+Saturn = Celestial("Saturn", 568.32e24, 58232., 1432.041e6, Sun, 0.052)
+Uranus = Celestial("Uranus", 86.811e24, 25362., 2867.043e6, Sun, 0.0469)
+Neptune = Celestial("Neptune", 102.409e24, 24622., 4514.953e6, Sun, 0.0097)
+Pluto = Celestial("Pluto", 0.01303e24, 1188., 5869.656e6, Sun, 0.2444)
 Planets = [Pluto, Neptune, Uranus, Saturn, Jupiter, Mars, Earth, Venus, Mercury]
 
-Moon = Celestial("Moon", 0.007348e24, 1737.4, 38.44e6, Earth)
+Moon = Celestial("Moon", 0.007348e24, 1737.4, 0.3844e6, Earth, 0.0549)
 Satellites = [Moon]
@@ -0,0 +1,158 @@
+import argparse
+import functools
+import os
+
+import numpy as np
+
+from kernels import roche_potential_3d
+from parallel import map_items
+from roche_lagrangian import lagrange_points
+from solar_constants import Celestial, Planets, Satellites
+from system_table import POINTS
+
+SWEEP_DTYPE = np.dtype(
+    [('mass_ratio', 'f8'), ('dist', 'f8')]
+    + [(point + axis, 'f8') for point in POINTS for axis in ('_x', '_y')]
+    + [('phi_l1', 'f8'), ('phi_l2', 'f8'), ('phi_l3', 'f8'), ('phi_l4_5', 'f8'),
+       ('roche_radius_1', 'f8'), ('roche_radius_2', 'f8'), ('lobe_radius', 'f8'), ('lobe_volume', 'f8')])
+
+
+def eggleton_radius(q):
+    """Eggleton (1983) volume-equivalent Roche lobe radius, in units of the separation, of a body
+    whose mass is q times its companion's"""
+    q = np.asarray(q, dtype=float)
+    return 0.49 * np.cbrt(q) ** 2 / (0.6 * np.cbrt(q) ** 2 + np.log1p(np.cbrt(q)))
+
+
+def lobe_volume(q, x_l1, order: int = 24, iterations: int = 40) -> np.ndarray:
+    """Roche lobe volume of the lighter body, in units of the separation cubed, for mass ratios q >= 1
+
+    Gauss-Legendre quadrature of r^3 / 3 over directions about the body (polar axis along
+    the line of centres, one quadrant of azimuth by symmetry), with the lobe radius along
+    each direction bisected up to the distance of L1, the lobe's furthest point.
+    """
+    q = np.asarray(q, dtype=float)[..., np.newaxis]
+    x1, x2 = -1 / (q + 1), q / (q + 1)
+    level = roche_potential_3d(x1, x2, np.asarray(x_l1)[..., np.newaxis], 0., 0.)
+    mu, mu_weights = np.polynomial.legendre.leggauss(order)
+    psi, psi_weights = np.polynomial.legendre.leggauss(order)
+    psi = (psi + 1.) * np.pi / 4.  # [-1, 1] -> [0, pi / 2]
+    psi_weights = psi_weights * np.pi / 4.
+    mu, psi = [axis.ravel() for axis in np.meshgrid(mu, psi)]
+    weights = np.outer(mu_weights, psi_weights).T.ravel()
+    sine = np.sqrt(1. - mu ** 2)
+    direction = (mu, sine * np.cos(psi), sine * np.sin(psi))
+
+    low = np.zeros(np.broadcast_shapes(q.shape[:-1] + (1,), mu.shape))
+    high = low + (x2 - np.asarray(x_l1)[..., np.newaxis])
+    with np.errstate(divide='ignore'):
+        for _ in range(iterations):
+            r = 0.5 * (low + high)
+            below = roche_potential_3d(x1, x2, x2 + r * direction[0], r * direction[1], r * direction[2]) < level
+            low = np.where(below, r, low)
+            high = np.where(below, high, r)
+    r = 0.5 * (low + high)
+    return 4. * np.sum(weights * r ** 3, axis=-1) / 3.
+
+
+def sweep(mass_ratio: np.ndarray, dist: np.ndarray, order: int = 24) -> np.ndarray:
+    """SWEEP_DTYPE rows for secondaries of mass_ratio (m_2 / m_1, at most 1) times their primary at dist km
+
+    Positions are in km from the barycenter as in system_table, radii in km and volumes in km^3.
+    """
+    mass_ratio, dist = np.broadcast_arrays(np.asarray(mass_ratio, dtype=float), np.asarray(dist, dtype=float))
+    if np.any((mass_ratio <= 0) | (mass_ratio > 1)):
+        raise ValueError('Mass ratios must be in (0, 1]')
+    xs, ys, phis = lagrange_points(1. / mass_ratio)
+
+    table = np.zeros(mass_ratio.shape, dtype=SWEEP_DTYPE)
+    table['mass_ratio'] = mass_ratio
+    table['dist'] = dist
+    for index, point in enumerate(POINTS):
+        table[point + '_x'] = xs[..., index] * dist
+        table[point + '_y'] = ys[..., index] * dist
+    table['phi_l1'], table['phi_l2'], table['phi_l3'], table['phi_l4_5'] = np.moveaxis(phis[..., :4], -1, 0)
+    table['roche_radius_1'] = eggleton_radius(1. / mass_ratio) * dist
+    table['roche_radius_2'] = eggleton_radius(mass_ratio) * dist
+    volume = lobe_volume(1. / mass_ratio, xs[..., 0], order)
+    table['lobe_radius'] = np.cbrt(volume * 3. / (4. * np.pi)) * dist
+    table['lobe_volume'] = volume * dist ** 3
+    return table
+
+
+def grid(mass_ratios: np.ndarray, dists: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Flattened (mass_ratio, dist) of every combination"""
+    mass_ratio, dist = np.meshgrid(mass_ratios, dists, indexing='ij')
+    return mass_ratio.ravel(), dist.ravel()
+
+
+def catalog(bodies: list[Celestial]) -> tuple[np.ndarray, np.ndarray]:
+    """(mass_ratio, dist) of each body and its primary"""
+    m_1 = np.array([body.orbits.mass for body in bodies])
+    m_2 = np.array([body.mass for body in bodies])
+    return np.minimum(m_1, m_2) / np.maximum(m_1, m_2), np.array([body.semimajor for body in bodies])
+
+
+def _sweep_chunk(chunk: tuple[int, np.ndarray, np.ndarray], order: int) -> np.ndarray:
+    return sweep(chunk[1], chunk[2], order)
+
+
+def run_sweep(mass_ratio: np.ndarray, dist: np.ndarray, path: str, jobs: int = 1, chunk: int = 4096,
+              order: int = 24) -> str:
+    """Sweep in chunks over a process pool, streaming rows to a columnar file as they complete
+
+    A .parquet path is written with pyarrow; any other path becomes a directory holding one
+    .npy file per column.
+    """
+    mass_ratio, dist = [np.ravel(values) for values in np.broadcast_arrays(mass_ratio, dist)]
+    # each work item carries only its own slice to the worker
+    chunks = [(start, mass_ratio[start:start + chunk], dist[start:start + chunk])
+              for start in range(0, len(mass_ratio), chunk)]
+    work = functools.partial(_sweep_chunk, order=order)
+
+    if path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([(name, pa.float64()) for name in SWEEP_DTYPE.names])
+        with pq.ParquetWriter(path, schema) as writer:
+            for _, table in map_items(work, chunks, jobs):
+                writer.write_table(pa.table({name: table[name] for name in SWEEP_DTYPE.names}, schema=schema))
+        return path
+
+    os.makedirs(path, exist_ok=True)
+    columns = {name: np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                               dtype=SWEEP_DTYPE[name], shape=(len(mass_ratio),))
+               for name in SWEEP_DTYPE.names}
+    for (start, _, _), table in map_items(work, chunks, jobs):
+        for name, column in columns.items():
+            column[start:start + len(table)] = table[name]
+    for column in columns.values():
+        column.flush()
+    return path
+
+
+def main(argv: list[str] = None, prog: str = None):
+    parser = argparse.ArgumentParser(
+        prog=prog or os.path.basename(__file__),
+        description='Sweep Lagrange points, Roche radii and lobe volumes over mass ratios and distances')
+    parser.add_argument('-o', '--output', type=str, default='sweep', help='Parquet file or .npy column directory')
+    parser.add_argument('--ratios', type=float, nargs=3, default=[1e-9, 1e-1, 100], metavar=('MIN', 'MAX', 'N'),
+                        help='Log-spaced mass ratios m_2 / m_1')
+    parser.add_argument('--distances', type=float, nargs=3, default=[1e5, 1e10, 100], metavar=('MIN', 'MAX', 'N'),
+                        help='Log-spaced separations in km')
+    parser.add_argument('--catalog', action='store_true', help='Sweep the planets and satellites instead')
+    parser.add_argument('--order', type=int, default=24, help='Quadrature nodes per angle for lobe volumes')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 for all cores)')
+    parser.add_argument('--chunk', type=int, default=4096, help='Systems per work item')
+    args = parser.parse_args(argv)
+
+    if args.catalog:
+        mass_ratio, dist = catalog(Satellites + Planets)
+    else:
+        mass_ratio, dist = grid(np.geomspace(*args.ratios[:2], int(args.ratios[2])),
+                                np.geomspace(*args.distances[:2], int(args.distances[2])))
+    print('Saved to %s' % run_sweep(mass_ratio, dist, args.output, args.jobs, args.chunk, args.order))
+
+
+if __name__ == "__main__":
+    main()
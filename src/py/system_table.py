@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from roche_lagrangian import lagrange_points
+from solar_constants import Celestial, Planets, Satellites
+
+POINTS = ('l1', 'l2', 'l3', 'l4', 'l5')
+
+SYSTEM_DTYPE = np.dtype(
+    [('name', 'U16'), ('parent', 'U16'), ('semimajor', 'f8'), ('barycenter', 'f8'), ('m1_x', 'f8'), ('m2_x', 'f8')]
+    + [(point + axis, 'f8') for point in POINTS for axis in ('_x', '_y')]
+    + [('phi_l1', 'f8'), ('phi_l2', 'f8'), ('phi_l3', 'f8'), ('phi_l4_5', 'f8')])
+
+
+def system_table(bodies: list[Celestial]) -> np.ndarray:
+    """Barycenter, mass positions, Lagrange points and potentials of each body and its primary
+
+    Positions are in km from the barycenter as in RocheLagrangian; potentials are
+    dimensionless. Every body is solved in one vectorized pass.
+    """
+    table = np.zeros(len(bodies), dtype=SYSTEM_DTYPE)
+    if not bodies:
+        return table
+    m_1 = np.array([body.orbits.mass for body in bodies])
+    m_2 = np.array([body.mass for body in bodies])
+    dist = np.array([body.semimajor for body in bodies])
+    xs, ys, phis = lagrange_points(np.maximum(m_1, m_2) / np.minimum(m_1, m_2))
+
+    table['name'] = [body.name for body in bodies]
+    table['parent'] = [body.orbits.name for body in bodies]
+    table['semimajor'] = dist
+    table['barycenter'] = m_2 / (m_1 + m_2) * dist
+    table['m1_x'] = -table['barycenter']
+    table['m2_x'] = dist - table['barycenter']
+    for index, point in enumerate(POINTS):
+        table[point + '_x'] = xs[:, index] * dist
+        table[point + '_y'] = ys[:, index] * dist
+    table['phi_l1'], table['phi_l2'], table['phi_l3'], table['phi_l4_5'] = phis[:, :4].T
+    return table
+
+
+def write_system_table(table: np.ndarray, path: str) -> str:
+    """Save as JSON records (.json) or a structured NumPy array (.npy)"""
+    if path.endswith('.json'):
+        records = [{name: row[name].item() for name in table.dtype.names} for row in table]
+        with open(path, 'w') as handle:
+            json.dump(records, handle, indent=2)
+    elif path.endswith('.npy'):
+        np.save(path, table)
+    else:
+        raise ValueError('Unsupported table format: %s' % path)
+    return path
+
+
+def print_system(row: np.void):
+    print('%s:' % row['name'])
+    print('  %s: (%f, %f)' % (row['parent'], row['m1_x'], 0.))
+    print('  %s: (%f, %f)' % (row['name'], row['m2_x'], 0.))
+    print('  L1: (%f, %f) phi=%f' % (row['l1_x'], row['l1_y'], row['phi_l1']))
+    print('  L2: (%f, %f) phi=%f' % (row['l2_x'], row['l2_y'], row['phi_l2']))
+    print('  L3: (%f, %f) phi=%f' % (row['l3_x'], row['l3_y'], row['phi_l3']))
+    print('  L4: (%f, %f) phi=%f' % (row['l4_x'], row['l4_y'], row['phi_l4_5']))
+    print('  L5: (%f, %f) phi=%f' % (row['l5_x'], row['l5_y'], row['phi_l4_5']))
+
+
+def main(argv: list[str] = None, prog: str = None):
+    parser = argparse.ArgumentParser(
+        prog=prog or os.path.basename(__file__),
+        description='Tabulate Lagrange points and Roche potentials of solar system bodies')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Save table as .json or .npy (prints otherwise)')
+    args = parser.parse_args(argv)
+
+    system = system_table(Planets + Satellites)
+    if args.output:
+        print("Saved to %s" % write_system_table(system, args.output))
+    else:
+        for system_row in system:
+            print_system(system_row)
+
+
+if __name__ == "__main__":
+    main()
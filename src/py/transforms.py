@@ -0,0 +1,95 @@
+import numpy as np
+
+# rows of a grid each stage runs over before the next stage starts, so a chunk stays in cache
+CHUNK_ROWS = 64
+
+
+class LogLog:
+    """log10(log10(|z|)); -inf or nan where |z| <= 1, and inf on a mass"""
+
+    def __call__(self, z: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for func in (np.fabs, np.log10, np.log10):
+                func(z, out=z)
+        return z
+
+    def __repr__(self):
+        return 'LogLog()'
+
+
+class Clamp:
+    """min(z, limit)"""
+
+    def __init__(self, limit: float):
+        self.limit = limit
+
+    def __call__(self, z: np.ndarray) -> np.ndarray:
+        return np.minimum(z, self.limit, out=z)
+
+    def __repr__(self):
+        return 'Clamp(%r)' % self.limit
+
+
+class ScaleOffset:
+    """z * scale + offset"""
+
+    def __init__(self, scale: float = 1., offset: float = 0.):
+        self.scale = scale
+        self.offset = offset
+
+    def __call__(self, z: np.ndarray) -> np.ndarray:
+        if self.scale != 1.:
+            z *= self.scale
+        if self.offset:
+            z += self.offset
+        return z
+
+    def __repr__(self):
+        return 'ScaleOffset(%r, %r)' % (self.scale, self.offset)
+
+
+class Adjust(ScaleOffset):
+    """Unit distances to km, as Plottable.adjust"""
+
+    def __init__(self, dist: float):
+        super().__init__(dist)
+
+    def __repr__(self):
+        return 'Adjust(%r)' % self.scale
+
+
+class Transforms:
+    """A chain of elementwise stages applied in place, one chunk of rows at a time"""
+
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def __repr__(self):
+        return 'Transforms(%s)' % ', '.join(map(repr, self.stages))
+
+    def key(self) -> str:
+        """Identifies the chain, for cache keys"""
+        return repr(self)
+
+    def apply(self, z, copy: bool = False, dtype: np.dtype = None, rows: int = CHUNK_ROWS):
+        """z transformed, in place unless copy or z is read-only (e.g. a cached grid); scalars are returned as floats"""
+        scalar = np.ndim(z) == 0
+        if copy or scalar or not isinstance(z, np.ndarray) or not z.flags.writeable or (dtype and z.dtype != dtype):
+            z = np.array(z, dtype=dtype or (np.result_type(z, np.float32) if np.ndim(z) else float))
+        chunks = [z] if scalar else [z[start:start + rows] for start in range(0, len(z), rows)]
+        for chunk in chunks:
+            for stage in self.stages:
+                stage(chunk)
+        return float(z) if scalar else z
+
+    def fusable(self) -> tuple[float, float, float, 'Transforms']:
+        """(limit, scale, offset, rest): a leading Clamp and the affine stages after it folded into
+        min(z, limit) * scale + offset, as roche_log_log takes them, and the stages left over"""
+        stages = list(self.stages)
+        limit, scale, offset = np.inf, 1., 0.
+        if stages and type(stages[0]) is Clamp:
+            limit = stages.pop(0).limit
+        while stages and isinstance(stages[0], ScaleOffset):
+            stage = stages.pop(0)
+            scale, offset = scale * stage.scale, offset * stage.scale + stage.offset
+        return limit, scale, offset, Transforms(*stages)